@@ -1,3 +1,19 @@
-from django.test import TestCase
+from task_manager.testing import QueryBudgetTestCase
 
-# Create your tests here.
+
+class AccountViewQueryBudgetTests(QueryBudgetTestCase):
+    def test_profile(self):
+        self.assertWithinBudget('profile')
+
+    def test_account_delete(self):
+        self.assertWithinBudget('account_delete')
+
+    def test_account_delete_confirm_wrong_password(self):
+        self.assertWithinBudget('account_delete_confirm', method='post', data={'password': 'wrong'})
+
+    def test_home_redirects_logged_in_user(self):
+        self.assertWithinBudget('home')
+
+    def test_register_page(self):
+        self.client.logout()
+        self.assertWithinBudget('register')
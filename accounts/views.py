@@ -2,7 +2,7 @@ from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from .forms import UserRegisterForm, UserUpdateForm, ProfileUpdateForm
-from tasks.models import Task, Category
+from tasks.models import TaskStats
 from .forms import UserRegisterForm, UserUpdateForm, ProfileUpdateForm
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash
@@ -42,18 +42,15 @@ def profile(request):
         p_form = ProfileUpdateForm(instance=request.user.profile)
     
     # Get task counts
-    total_tasks = Task.objects.filter(user=request.user).count()
-    completed_tasks = Task.objects.filter(user=request.user, status='completed').count()
-    pending_tasks = Task.objects.filter(user=request.user, status='pending').count()
-    in_progress_tasks = Task.objects.filter(user=request.user, status='in_progress').count()
+    stats = TaskStats.for_user(request.user)
     
     context = {
         'u_form': u_form,
         'p_form': p_form,
-        'total_tasks': total_tasks,
-        'completed_tasks': completed_tasks,
-        'pending_tasks': pending_tasks,
-        'in_progress_tasks': in_progress_tasks,
+        'total_tasks': stats.total,
+        'completed_tasks': stats.completed,
+        'pending_tasks': stats.pending,
+        'in_progress_tasks': stats.in_progress,
     }
     return render(request, 'accounts/profile.html', context)
 
@@ -81,12 +78,11 @@ def password_change_done(request):
 def account_delete(request):
     """Show account deletion confirmation page"""
     # Get user statistics
-    total_tasks = Task.objects.filter(user=request.user).count()
-    total_categories = Category.objects.filter(user=request.user).count()
+    stats = TaskStats.for_user(request.user)
     
     context = {
-        'total_tasks': total_tasks,
-        'total_categories': total_categories,
+        'total_tasks': stats.total,
+        'total_categories': stats.categories,
     }
     return render(request, 'accounts/account_delete.html', context)
 
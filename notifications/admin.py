@@ -1,6 +1,11 @@
 from django.contrib import admin
-from .models import Notification
+from .models import Notification, Broadcast, OutboxMessage, ArchivedNotification, EmailPreference, QueuedEmail
 
 # Register your models here.
 
 admin.site.register(Notification)
+admin.site.register(Broadcast)
+admin.site.register(OutboxMessage)
+admin.site.register(ArchivedNotification)
+admin.site.register(EmailPreference)
+admin.site.register(QueuedEmail)
@@ -0,0 +1,189 @@
+"""
+Fan-out benchmark for NotificationConsumer, driven by the
+bench_notifications management command.
+
+Simulated users never touch the database: their navbar snapshots are
+seeded in the cache, so connecting measures the consumer and the channel
+layer rather than SQL.
+"""
+import asyncio
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+import channels
+import django
+import msgpack
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .broadcast import latest_broadcast_id
+from .consumers import NotificationConsumer
+from .models import OutboxMessage
+from .navbar import NAVBAR_TIMEOUT, navbar_key
+from .outbox import _push
+
+MEMORY_LAYER = {'default': {
+    'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    'CONFIG': {'capacity': 10000},
+}}
+# Big enough that culling never evicts the seeded snapshots mid-run
+LOCAL_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'OPTIONS': {'MAX_ENTRIES': 10 ** 7},
+}}
+
+# Far above real ids, so simulated users can never collide with real ones
+BENCH_USER_ID = 10 ** 12
+CONNECT_CONCURRENCY = 100
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def _bench_users(count):
+    users = [User(pk=BENCH_USER_ID + i, username=f'bench{i}') for i in range(count)]
+    snapshot = {
+        'unread_count': 0, 'latest': [], 'broadcast_id': latest_broadcast_id(), 'built_at': time.time(),
+    }
+    cache.set_many({navbar_key(user.pk): dict(snapshot) for user in users}, NAVBAR_TIMEOUT)
+    return users
+
+
+def _decode(output):
+    """Client events in one frame, whatever the protocol"""
+    if 'bytes' in output and output['bytes'] is not None:
+        frame = msgpack.unpackb(output['bytes'])
+    else:
+        frame = json.loads(output['text'])
+    return frame['events'] if frame.get('type') == 'batch' else [frame]
+
+
+async def _connect(user, protocol, timeout):
+    subprotocols = [protocol] if protocol else None
+    communicator = WebsocketCommunicator(
+        NotificationConsumer.as_asgi(), '/ws/notifications/', subprotocols=subprotocols
+    )
+    communicator.scope['user'] = user
+    connected, _ = await communicator.connect(timeout)
+    if not connected:
+        raise RuntimeError(f'Consumer refused {user.username}')
+    await communicator.receive_output(timeout)  # initial unread count
+    return communicator
+
+
+async def _collect(communicator, expected, latencies, timeout):
+    received = 0
+    while received < expected:
+        output = await communicator.receive_output(timeout)
+        now = time.perf_counter()
+        for event in _decode(output):
+            if event.get('type') == 'notification':
+                latencies.append((now - event['notification']['sent_at']) * 1000)
+                received += 1
+
+
+async def run_benchmark(connections=100, bursts=10, burst_size=100, protocol=None, seed=0,
+                        timeout=10):
+    """
+    Open `connections` simulated sockets, push `bursts` bursts of
+    `burst_size` notifications to randomly chosen users through the
+    outbox dispatcher's push path, and return a results dict.
+    """
+    rng = random.Random(seed)
+    users = await sync_to_async(_bench_users)(connections)
+
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    communicators = []
+    started = time.perf_counter()
+    for start in range(0, len(users), CONNECT_CONCURRENCY):
+        communicators += await asyncio.gather(*[
+            _connect(user, protocol, timeout) for user in users[start:start + CONNECT_CONCURRENCY]
+        ])
+    connect_seconds = time.perf_counter() - started
+    memory_per_connection = (tracemalloc.get_traced_memory()[0] - memory_before) / connections
+    tracemalloc.stop()
+
+    latencies = []
+    delivered = 0
+    push_seconds = 0.0
+    seq = 0
+    for _ in range(bursts):
+        targets = [rng.randrange(connections) for _ in range(burst_size)]
+        messages = []
+        for index in targets:
+            seq += 1
+            messages.append(OutboxMessage(group=f'user_{users[index].pk}', event={
+                'type': 'send_notification',
+                'seq': seq,
+                'notification': {'id': seq, 'title': 'Benchmark', 'sent_at': time.perf_counter()},
+            }))
+        expected = {}
+        for index in targets:
+            expected[index] = expected.get(index, 0) + 1
+
+        burst_started = time.perf_counter()
+        await _push(messages)
+        await asyncio.gather(*[
+            _collect(communicators[index], count, latencies, timeout)
+            for index, count in expected.items()
+        ])
+        push_seconds += time.perf_counter() - burst_started
+        delivered += burst_size
+
+    for communicator in communicators:
+        await communicator.disconnect()
+
+    return {
+        'params': {
+            'connections': connections, 'bursts': bursts, 'burst_size': burst_size,
+            'protocol': protocol or 'legacy', 'seed': seed,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'channels': channels.__version__,
+            'channel_layer': type(get_channel_layer()).__name__,
+        },
+        'results': {
+            'connect_seconds': round(connect_seconds, 3),
+            'delivered': delivered,
+            'throughput_per_second': round(delivered / push_seconds, 1) if push_seconds else None,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 3),
+                'p90': round(percentile(latencies, 90), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(max(latencies), 3),
+            },
+            'memory_per_connection_kib': round(memory_per_connection / 1024, 2),
+        },
+    }
+
+
+def compare(current, baseline):
+    """Relative change of each numeric result against an earlier run, in percent"""
+    def flatten(results, prefix=''):
+        for key, value in results.items():
+            if isinstance(value, dict):
+                yield from flatten(value, f'{prefix}{key}.')
+            elif isinstance(value, (int, float)):
+                yield f'{prefix}{key}', value
+
+    before = dict(flatten(baseline['results']))
+    changes = {}
+    for name, value in flatten(current['results']):
+        if before.get(name):
+            changes[name] = round((value - before[name]) / before[name] * 100, 1)
+    return changes
@@ -0,0 +1,74 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+
+from .models import Broadcast, BroadcastState, Notification
+from .outbox import enqueue
+
+# Every NotificationConsumer joins this group, so a broadcast is one
+# group_send no matter how many users are connected.
+BROADCAST_GROUP = 'broadcasts'
+LATEST_BROADCAST_KEY = 'notifications:broadcast:latest'
+
+
+def latest_broadcast_id():
+    """Id of the newest broadcast (0 if none), cached until the next one"""
+    latest = cache.get(LATEST_BROADCAST_KEY)
+    if latest is None:
+        latest = Broadcast.objects.aggregate(latest=Max('pk'))['latest'] or 0
+        cache.set(LATEST_BROADCAST_KEY, latest, None)
+    return latest
+
+
+def deliver_broadcasts(user, through=None):
+    """
+    Copy any broadcasts the user has not received yet into their
+    notifications and queue their pushes to the user's group, so every
+    open tab or device gets them, not just the caller that got here
+    first. Returns the Notification rows created.
+
+    Broadcasts sent before the user joined are skipped, the same as the
+    old per-user loop which only reached existing accounts.
+    """
+    from .utils import send_real_time_notifications
+
+    if through is None:
+        through = latest_broadcast_id()
+    if not through:
+        return []
+
+    with transaction.atomic():
+        state, _ = BroadcastState.objects.select_for_update().get_or_create(user=user)
+        if state.delivered_through >= through:
+            return []
+        broadcasts = Broadcast.objects.filter(
+            pk__gt=state.delivered_through,
+            pk__lte=through,
+            created_at__gte=user.date_joined,
+        ).order_by('pk')
+        notifications = Notification.objects.bulk_create(
+            [broadcast.notification_for(user) for broadcast in broadcasts]
+        )
+        state.delivered_through = through
+        state.save(update_fields=['delivered_through'])
+        send_real_time_notifications(notifications)
+    return notifications
+
+
+def send_broadcast(title, message, notification_type='system', related_url=''):
+    """
+    Announce something to every user with one INSERT and one queued
+    group_send.
+
+    Per-user rows are created lazily by deliver_broadcasts, from the
+    navbar on the next page view or from a connected consumer.
+    """
+    with transaction.atomic():
+        broadcast = Broadcast.objects.create(
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            related_url=related_url,
+        )
+        enqueue(BROADCAST_GROUP, {'type': 'send_broadcast', 'broadcast_id': broadcast.pk})
+    return broadcast
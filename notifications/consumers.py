@@ -1,12 +1,32 @@
+import asyncio
 import json
+from urllib.parse import parse_qs
+import msgpack
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
-from django.utils import timezone
+
+from . import presence
+from .broadcast import BROADCAST_GROUP
+
+# Opt-in batched protocols, offered by the client as WebSocket subprotocols.
+# Without one, every event is its own JSON text frame as before.
+PROTOCOL_MSGPACK = 'notifications.batch.msgpack'
+PROTOCOL_JSON = 'notifications.batch.json'
+BATCH_PROTOCOLS = [PROTOCOL_MSGPACK, PROTOCOL_JSON]  # in order of preference
+
+COALESCE_WINDOW = 0.05  # seconds events may wait to share a frame
+SEND_QUEUE_LIMIT = 100  # events held per connection before the oldest are dropped
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
+        offered = self.scope.get('subprotocols') or []
+        self.protocol = next((p for p in BATCH_PROTOCOLS if p in offered), None)
+        self.send_queue = []
+        self.dropped = 0
+        self.flush_task = None
+        self.heartbeat_task = None
         
         if self.user.is_authenticated:
             self.group_name = f'user_{self.user.id}'
@@ -16,27 +36,58 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.group_name,
                 self.channel_name
             )
+            await self.channel_layer.group_add(BROADCAST_GROUP, self.channel_name)
             
-            await self.accept()
+            await self.accept(subprotocol=self.protocol)
+            await presence.connected(self.user.id)
+            self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
             
             # Send current unread count
             unread_count = await self.get_unread_count()
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 'type': 'unread_count',
                 'count': unread_count
-            }))
+            })
+            
+            # Replay what was pushed while the client was away. The group is
+            # joined first, so nothing falls in between; the client skips
+            # any seq it has already seen.
+            resume_from = self.resume_from()
+            if resume_from is not None:
+                for event in await self.get_missed_events(resume_from):
+                    await self.send_notification(event)
         else:
             await self.close()
     
+    def resume_from(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            return int(query['resume_from'][0])
+        except (KeyError, ValueError):
+            return None
+    
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(presence.PRESENCE_HEARTBEAT)
+            await presence.heartbeat(self.user.id)
+    
     async def disconnect(self, close_code):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            await presence.disconnected(self.user.id)
         if self.user.is_authenticated:
             # Leave user group
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
+            await self.channel_layer.group_discard(BROADCAST_GROUP, self.channel_name)
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            return
         text_data_json = json.loads(text_data)
         message_type = text_data_json.get('type')
         
@@ -46,34 +97,107 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             
             # Send updated count
             unread_count = await self.get_unread_count()
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 'type': 'unread_count',
                 'count': unread_count
-            }))
+            })
         
         elif message_type == 'mark_all_as_read':
             await self.mark_all_notifications_as_read()
             
             # Send updated count
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 'type': 'unread_count',
                 'count': 0
-            }))
+            })
     
     async def send_notification(self, event):
         """Send notification to WebSocket"""
-        await self.send(text_data=json.dumps(event))
+        await self.send_event({
+            'type': 'notification',
+            'seq': event['seq'],
+            'notification': event['notification']
+        })
+    
+    async def send_unread_count(self, event):
+        """The count changed, e.g. notifications were read in another tab"""
+        await self.send_event({
+            'type': 'unread_count',
+            'count': await self.get_unread_count()
+        })
+    
+    async def send_event(self, payload):
+        """
+        Send one client event. In a batched protocol it waits up to
+        COALESCE_WINDOW so a burst goes out as a single frame.
+        """
+        if self.protocol is None:
+            await self.send(text_data=json.dumps(payload))
+            return
+        
+        self.send_queue.append(payload)
+        overflow = len(self.send_queue) - SEND_QUEUE_LIMIT
+        if overflow > 0:
+            # A slow client must not grow memory; it resyncs from `dropped`
+            del self.send_queue[:overflow]
+            self.dropped += overflow
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+    
+    async def flush_later(self):
+        # Only one frame is in flight at a time. Events that arrive while
+        # a slow client is still taking the last one wait in send_queue,
+        # so SEND_QUEUE_LIMIT is what bounds memory, not the server buffer.
+        try:
+            while self.send_queue:
+                await asyncio.sleep(COALESCE_WINDOW)
+                await self.flush()
+        finally:
+            self.flush_task = None
+    
+    async def flush(self):
+        frame = {'type': 'batch', 'events': self.send_queue}
+        if self.dropped:
+            frame['dropped'] = self.dropped
+        self.send_queue = []
+        self.dropped = 0
+        
+        if self.protocol == PROTOCOL_MSGPACK:
+            await self.send(bytes_data=msgpack.packb(frame))
+        else:
+            await self.send(text_data=json.dumps(frame, separators=(',', ':')))
+    
+    async def send_broadcast(self, event):
+        """
+        Deliver a broadcast to this user. The copy is pushed to the user's
+        group, so it reaches this socket like any other notification.
+        """
+        await self.deliver_broadcasts(event['broadcast_id'])
+    
+    @database_sync_to_async
+    def deliver_broadcasts(self, broadcast_id):
+        from .broadcast import deliver_broadcasts
+        # The navbar snapshot notices the newer broadcast id and rebuilds itself
+        deliver_broadcasts(self.user, broadcast_id)
+    
+    @database_sync_to_async
+    def get_missed_events(self, resume_from):
+        from .replay import missed_events
+        return missed_events(self.user, resume_from)
     
     @database_sync_to_async
     def get_unread_count(self):
-        from .models import Notification
-        return Notification.objects.filter(user=self.user, is_read=False).count()
+        # Read from the navbar snapshot; only a cold or stale cache queries
+        from .navbar import unread_count
+        return unread_count(self.user)
     
     @database_sync_to_async
     def mark_notification_as_read(self, notification_id):
         from .models import Notification
         try:
-            notification = Notification.objects.get(id=notification_id, user=self.user)
+            notification = Notification.objects.with_read_state(self.user).get(
+                id=notification_id, user=self.user
+            )
             notification.mark_as_read()
         except Notification.DoesNotExist:
             pass
@@ -81,7 +205,4 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def mark_all_notifications_as_read(self):
         from .models import Notification
-        Notification.objects.filter(user=self.user, is_read=False).update(
-            is_read=True, 
-            read_at=timezone.now()
-        )
\ No newline at end of file
+        Notification.mark_all_as_read(self.user)
\ No newline at end of file
@@ -1,7 +1,10 @@
-from .models import Notification
+from .navbar import get_navbar_snapshot
 
 def unread_notifications_count(request):
     if request.user.is_authenticated:
-        count = Notification.objects.filter(user=request.user, is_read=False).count()
-        return {'unread_notifications_count': count}
-    return {'unread_notifications_count': 0}
\ No newline at end of file
+        snapshot = get_navbar_snapshot(request.user)
+        return {
+            'unread_notifications_count': snapshot['unread_count'],
+            'navbar_notifications': snapshot['latest'],
+        }
+    return {'unread_notifications_count': 0, 'navbar_notifications': []}
\ No newline at end of file
@@ -0,0 +1,190 @@
+import logging
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import Min, Q
+
+from . import leases, wakeups
+from .models import EmailPreference, Notification, QueuedEmail
+
+logger = logging.getLogger(__name__)
+
+EMAIL_BATCH_SIZE = 100
+MAX_EMAIL_ATTEMPTS = 5
+EMAIL_RETRY_DELAY = 60  # seconds, doubled on every attempt
+# How long a sender owns the emails it claimed; well above a batch's send time
+EMAIL_LEASE = timedelta(minutes=10)
+EMAIL_WAKEUP_KEY = 'notifications:email:wakeup'
+DIGEST_CHUNK_SIZE = 500
+
+SUMMARY_TITLE = 'Daily Task Summary'
+REMINDER_TYPES = ['task_due', 'task_overdue']
+# Due and overdue reminders plus the daily summary, merged into one email
+DIGEST_FILTER = Q(notification_type__in=REMINDER_TYPES) | Q(notification_type='system', title=SUMMARY_TITLE)
+DIGEST_SECTIONS = (
+    ('task_overdue', 'Overdue'),
+    ('task_due', 'Due soon'),
+    ('system', 'Summary'),
+)
+
+
+def queue_email(to, subject, body, user=None):
+    """Queue one email; call inside the writing transaction"""
+    return QueuedEmail.objects.create(user=user, to=to, subject=subject, body=body)
+
+
+def queue_reminder_emails(notifications):
+    """
+    Queue one email per due/overdue reminder for users in 'instant' mode,
+    with one read and one INSERT however many users are involved.
+    """
+    reminders = [n for n in notifications if n.notification_type in REMINDER_TYPES]
+    if not reminders:
+        return []
+    default = settings.NOTIFICATION_EMAIL_MODE
+    users = User.objects.filter(pk__in={n.user_id for n in reminders}).exclude(email='').values_list(
+        'pk', 'email', 'email_preference__mode'
+    )
+    recipients = {pk: email for pk, email, mode in users if (mode or default) == 'instant'}
+    return QueuedEmail.objects.bulk_create([
+        QueuedEmail(user_id=n.user_id, to=recipients[n.user_id], subject=n.title, body=n.message)
+        for n in reminders if n.user_id in recipients
+    ])
+
+
+def digest_body(username, notifications):
+    """Plain-text digest, newest summary only and reminders grouped by type"""
+    lines = [f'Hi {username},', '', 'Here is your Task Manager digest.']
+    for notification_type, heading in DIGEST_SECTIONS:
+        items = [n for n in notifications if n.notification_type == notification_type]
+        if notification_type == 'system':
+            items = items[-1:]
+        if items:
+            lines += ['', f'{heading}:'] + [f'- {n.message}' for n in items]
+    return '\n'.join(lines) + '\n'
+
+
+def queue_digests(chunk_size=DIGEST_CHUNK_SIZE):
+    """
+    Queue one digest email per 'digest' user with anything new since their
+    last digest. Each chunk of users costs a read of their preferences, one
+    read of their notifications, a bulk INSERT and a bulk UPDATE.
+    Returns how many digests were queued.
+    """
+    preferences = EmailPreference.objects.filter(mode='digest', user__is_active=True).exclude(
+        user__email=''
+    ).select_related('user').order_by('pk')
+    queued = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(preferences.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+
+            by_user = {}
+            notifications = Notification.objects.filter(
+                DIGEST_FILTER,
+                user_id__in=[preference.pk for preference in chunk],
+                pk__gt=min(preference.digest_through for preference in chunk),
+            ).order_by('pk').only('id', 'user_id', 'notification_type', 'message')
+            for notification in notifications:
+                by_user.setdefault(notification.user_id, []).append(notification)
+
+            emails, covered = [], []
+            for preference in chunk:
+                items = [n for n in by_user.get(preference.pk, []) if n.pk > preference.digest_through]
+                if not items:
+                    continue
+                emails.append(QueuedEmail(
+                    user_id=preference.pk,
+                    to=preference.user.email,
+                    subject=f'Your Task Manager digest: {len(items)} updates',
+                    body=digest_body(preference.user.username, items),
+                ))
+                preference.digest_through = items[-1].pk
+                covered.append(preference)
+            QueuedEmail.objects.bulk_create(emails)
+            EmailPreference.objects.bulk_update(covered, ['digest_through'])
+
+        queued += len(emails)
+        if len(chunk) < chunk_size:
+            break
+    return queued
+
+
+def claim_emails(batch_size=EMAIL_BATCH_SIZE, pks=None, now=None):
+    """
+    Lease up to `batch_size` due emails (only `pks`, if given) for
+    EMAIL_LEASE, see leases.claim.
+    """
+    queryset = QueuedEmail.objects.all()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    return leases.claim(queryset, batch_size, EMAIL_LEASE, now)
+
+
+def deliver_emails(batch_size=EMAIL_BATCH_SIZE, pks=None):
+    """
+    Send one batch of due queued emails (only `pks`, if given) over a
+    single SMTP connection. Returns how many were sent.
+
+    The batch is leased first, so the SMTP session runs outside any
+    transaction and several senders can run side by side. Sent emails are
+    deleted afterwards; failed ones are retried with exponential backoff
+    and dropped after MAX_EMAIL_ATTEMPTS.
+    """
+    queued = claim_emails(batch_size, pks)
+    if not queued:
+        return 0
+
+    sent = []
+    try:
+        with get_connection() as connection:
+            for email in queued:
+                try:
+                    connection.send_messages([email.as_message(connection)])
+                except (smtplib.SMTPException, OSError) as exc:
+                    logger.warning('Email %s to %s failed: %r', email.pk, email.to, exc)
+                else:
+                    sent.append(email.pk)
+    except (smtplib.SMTPException, OSError) as exc:
+        # Could not connect (or the connection dropped on close)
+        logger.warning('SMTP connection failed: %r', exc)
+
+    leases.settle(queued, sent, MAX_EMAIL_ATTEMPTS, EMAIL_RETRY_DELAY)
+    return len(sent)
+
+
+def drain_emails(batch_size=EMAIL_BATCH_SIZE):
+    """Deliver batches until nothing due is left or a batch had failures"""
+    total = 0
+    while True:
+        sent = deliver_emails(batch_size)
+        total += sent
+        if sent < batch_size:
+            return total
+
+
+def next_email_at():
+    """When the next queued email (usually a retry) becomes due, or None"""
+    return QueuedEmail.objects.aggregate(at=Min('available_at'))['at']
+
+
+def schedule_delivery(at):
+    """
+    Make sure deliver_queued_emails runs at `at`. Only one such wake-up is
+    pending at a time, however many runs ask for one.
+    """
+    from .tasks import deliver_queued_emails
+
+    return wakeups.schedule_wakeup(deliver_queued_emails, EMAIL_WAKEUP_KEY, at)
+
+
+def delivery_cancelled(token):
+    return wakeups.is_cancelled(EMAIL_WAKEUP_KEY, token)
@@ -0,0 +1,62 @@
+"""
+Leased work queues: tables whose rows carry `attempts` and `available_at`
+and are drained by several workers side by side (the outbox and queued
+emails).
+
+A worker claims a batch in one short transaction: the due rows are
+picked with SKIP LOCKED where the database supports it, counted as an
+attempt and hidden from other workers until the lease runs out. The slow
+part (a push, an SMTP session) then runs outside any transaction, and
+settle() deletes or reschedules the batch in a second short one. If a
+worker dies mid-batch, its rows simply become due again.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+def claim(queryset, batch_size, lease, now=None):
+    """
+    Lease up to `batch_size` due rows of `queryset` for `lease`. Rows come
+    back as they were before the lease.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        rows = list(
+            queryset.select_for_update(skip_locked=True)
+            .filter(available_at__lte=now)
+            .order_by('pk')[:batch_size]
+        )
+        queryset.model.objects.filter(pk__in=[row.pk for row in rows]).update(
+            attempts=F('attempts') + 1,
+            available_at=now + lease,
+        )
+    return rows
+
+
+def settle(rows, done, max_attempts, retry_delay):
+    """
+    Finish a claimed batch: delete the rows whose pk is in `done` and the
+    failed ones out of attempts, and make the other failures due again
+    after `retry_delay` seconds, doubled on every attempt.
+    """
+    if not rows:
+        return
+    model = type(rows[0])
+    now = timezone.now()
+    done = set(done)
+    # `attempts` is still the count from before this one
+    failed = [row for row in rows if row.pk not in done]
+    expired = {row.pk for row in failed if row.attempts + 1 >= max_attempts}
+    retry = {}
+    for row in failed:
+        if row.pk not in expired:
+            retry.setdefault(row.attempts, []).append(row.pk)
+    with transaction.atomic():
+        model.objects.filter(pk__in=done | expired).delete()
+        for attempts, pks in retry.items():
+            model.objects.filter(pk__in=pks).update(
+                available_at=now + timedelta(seconds=retry_delay * 2 ** attempts),
+            )
@@ -0,0 +1,58 @@
+import json
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from notifications.broadcast import LATEST_BROADCAST_KEY
+from notifications.bench import LOCAL_CACHE, MEMORY_LAYER, compare, run_benchmark
+from notifications.consumers import BATCH_PROTOCOLS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark real-time notification fan-out over simulated WebSocket connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=100)
+        parser.add_argument('--bursts', type=int, default=10)
+        parser.add_argument('--burst-size', type=int, default=100)
+        parser.add_argument('--protocol', choices=BATCH_PROTOCOLS,
+                            help='Batched subprotocol to negotiate; one frame per event if omitted')
+        parser.add_argument('--layer', choices=['memory', 'settings'], default='memory',
+                            help='"memory" swaps in the in-memory channel layer and a local cache, '
+                                 '"settings" uses CHANNEL_LAYERS and CACHES as configured')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for picking burst targets, keep it fixed to compare runs')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Earlier --output file to report changes against')
+
+    def handle(self, *args, **options):
+        if options['connections'] < 1 or options['burst_size'] < 1:
+            raise CommandError('--connections and --burst-size must be at least 1')
+
+        kwargs = {
+            'connections': options['connections'],
+            'bursts': options['bursts'],
+            'burst_size': options['burst_size'],
+            'protocol': options['protocol'],
+            'seed': options['seed'],
+        }
+        if options['layer'] == 'memory':
+            with override_settings(CHANNEL_LAYERS=MEMORY_LAYER, CACHES=LOCAL_CACHE):
+                # Nothing to deliver in the private cache, so connecting
+                # never has to look up broadcasts in the database
+                cache.set(LATEST_BROADCAST_KEY, 0, None)
+                report = async_to_sync(run_benchmark)(**kwargs)
+        else:
+            report = async_to_sync(run_benchmark)(**kwargs)
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                report['change_percent'] = compare(report, json.load(baseline))
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as target:
+                target.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.outbox import OUTBOX_BATCH_SIZE, CircuitBreaker, drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Push queued real-time notifications to the channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the outbox instead of draining it once')
+        parser.add_argument('--interval', type=float, default=0.5,
+                            help='Seconds to sleep between polls when the outbox is empty')
+
+    def handle(self, *args, **options):
+        breaker = CircuitBreaker()
+        if not options['loop']:
+            sent = drain_outbox(options['batch_size'], breaker)
+            self.stdout.write(self.style.SUCCESS(f'Dispatched {sent} outbox messages'))
+            return
+
+        self.stdout.write('Dispatching outbox messages, press Ctrl+C to stop')
+        try:
+            while True:
+                if not drain_outbox(options['batch_size'], breaker):
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
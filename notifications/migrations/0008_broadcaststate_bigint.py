@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 05:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0007_email_delivery'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='broadcaststate',
+            name='delivered_through',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
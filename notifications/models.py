@@ -1,7 +1,38 @@
-from django.db import models
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import models, transaction
+from django.db.models import BooleanField, ExpressionWrapper, Max, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.utils import timezone
 
+def read_watermark(user):
+    """SQL expression for the user's read-through id, 0 if never marked"""
+    return Coalesce(
+        Subquery(ReadWatermark.objects.filter(user=user).values('read_through')[:1]),
+        Value(0),
+    )
+
+
+class NotificationQuerySet(models.QuerySet):
+    def unread_for(self, user):
+        """The user's notifications that are unread by flag and watermark"""
+        return self.filter(user=user, is_read=False, pk__gt=read_watermark(user))
+
+    def read_for(self, user):
+        """The user's notifications that count as read"""
+        return self.filter(Q(is_read=True) | Q(pk__lte=read_watermark(user)), user=user)
+
+    def with_read_state(self, user):
+        """Annotate below_watermark so Notification.unread is exact"""
+        return self.annotate(below_watermark=ExpressionWrapper(
+            Q(pk__lte=read_watermark(user)), output_field=BooleanField()
+        ))
+
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('task_created', 'Task Created'),
@@ -23,21 +54,66 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     read_at = models.DateTimeField(null=True, blank=True)
+    broadcast = models.ForeignKey(
+        'Broadcast', on_delete=models.CASCADE, null=True, blank=True, related_name='notifications'
+    )
+    
+    objects = NotificationQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user', 'is_read', 'created_at']),
+            # Unread lookups are a range scan above the read watermark
+            models.Index(fields=['user', 'is_read', 'id'], name='notifications_unread_idx'),
+            # Reconnect replay reads a user's notifications above a seq
+            models.Index(fields=['user', 'id'], name='notifications_replay_idx'),
         ]
     
     def __str__(self):
         return f"{self.get_notification_type_display()} - {self.user.username}"
     
+    @property
+    def unread(self):
+        """
+        Read state from the row flag plus, when the row was loaded through
+        with_read_state(), the user's mark-all watermark.
+        """
+        return not (self.is_read or getattr(self, 'below_watermark', False))
+    
     def mark_as_read(self):
-        if not self.is_read:
+        from .navbar import navbar_mark_read
+        from .utils import send_unread_count
+        if self.unread:
+            now = timezone.now()
+            # Conditional so a row already covered by the watermark, or read
+            # concurrently, does not lower the unread counter twice
+            updated = Notification.objects.unread_for(self.user_id).filter(pk=self.pk).update(
+                is_read=True, read_at=now
+            )
             self.is_read = True
-            self.read_at = timezone.now()
-            self.save()
+            self.read_at = now
+            if updated:
+                navbar_mark_read(self)
+                send_unread_count(self.user_id)
+    
+    @classmethod
+    def mark_all_as_read(cls, user):
+        """
+        Mark everything the user has as read with a single-row write,
+        by moving their watermark past the newest notification.
+        """
+        from .navbar import navbar_mark_all_read
+        from .utils import send_unread_count
+        latest = cls.objects.aggregate(latest=Max('pk'))['latest'] or 0
+        ReadWatermark.objects.bulk_create(
+            [ReadWatermark(user=user, read_through=latest)],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['read_through', 'updated_at'],
+        )
+        navbar_mark_all_read(user.pk)
+        send_unread_count(user.pk)
     
     @property
     def icon(self):
@@ -50,4 +126,173 @@ class Notification(models.Model):
             'task_assigned': 'fas fa-user-plus text-primary',
             'system': 'fas fa-cog text-secondary',
         }
-        return icons.get(self.notification_type, 'fas fa-bell')
\ No newline at end of file
+        return icons.get(self.notification_type, 'fas fa-bell')
+
+class ArchivedNotification(models.Model):
+    """
+    Cold copy of a notification removed by the retention job. Keeps the
+    original id and only what is needed to show or export it later.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notifications')
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    related_url = models.CharField(max_length=200, blank=True)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_notification_type_display()} - {self.user_id}"
+
+
+class ReadWatermark(models.Model):
+    """Every notification of the user with id <= read_through counts as read"""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='notification_watermark'
+    )
+    read_through = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.read_through}"
+
+
+class Broadcast(models.Model):
+    """
+    One announcement for every user. Each user gets their own Notification
+    row the next time they load a page, see notifications.broadcast.
+    """
+    notification_type = models.CharField(
+        max_length=20, choices=Notification.NOTIFICATION_TYPES, default='system'
+    )
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    related_url = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.title
+
+    def notification_for(self, user):
+        """Unsaved per-user copy of this broadcast"""
+        return Notification(
+            user=user,
+            broadcast=self,
+            notification_type=self.notification_type,
+            title=self.title,
+            message=self.message,
+            related_url=self.related_url,
+        )
+
+
+class BroadcastState(models.Model):
+    """How far through the broadcasts a user has been delivered"""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='broadcast_state'
+    )
+    delivered_through = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.delivered_through}"
+
+
+@receiver([post_save, post_delete], sender=Broadcast)
+def invalidate_latest_broadcast(sender, instance, **kwargs):
+    from .broadcast import LATEST_BROADCAST_KEY
+    transaction.on_commit(lambda: cache.delete(LATEST_BROADCAST_KEY))
+
+
+@receiver(post_save, sender='tasks.Task')
+def schedule_task_reminder(sender, instance, update_fields=None, **kwargs):
+    """Wake the reminder job when this task's next reminder is due"""
+    if update_fields is not None and not {'status', 'due_date', 'reminder_state'} & set(update_fields):
+        return
+    from .reminders import next_reminder_at, schedule_wakeup
+    at = next_reminder_at(instance)
+    if at is not None:
+        transaction.on_commit(lambda: schedule_wakeup(at))
+
+
+class OutboxMessage(models.Model):
+    """
+    A channel-layer message waiting to be pushed. Rows are written in the
+    same transaction as the notification they announce and drained by
+    notifications.outbox.dispatch_outbox.
+    """
+    group = models.CharField(max_length=100)
+    event = models.JSONField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['available_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.group} ({self.attempts} attempts)"
+
+
+class EmailPreference(models.Model):
+    """
+    How a user gets reminder emails. Users without a row use
+    settings.NOTIFICATION_EMAIL_MODE. digest_through is the last
+    notification id already covered by a digest.
+    """
+    MODE_CHOICES = [
+        ('instant', 'Email each due/overdue reminder'),
+        ('digest', 'One daily digest email'),
+        ('off', 'No emails'),
+    ]
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='email_preference')
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES)
+    digest_through = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['mode', 'user']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.mode}"
+
+
+class QueuedEmail(models.Model):
+    """
+    An outbound email waiting for notifications.email.deliver_emails,
+    which sends whole batches over one SMTP connection.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True,
+                             related_name='queued_emails')
+    to = models.EmailField()
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['available_at', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.to}: {self.subject} ({self.attempts} attempts)"
+    
+    def as_message(self, connection=None):
+        return EmailMessage(self.subject, self.body, settings.DEFAULT_FROM_EMAIL, [self.to],
+                            connection=connection)
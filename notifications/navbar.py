@@ -0,0 +1,141 @@
+import time
+
+from django.core.cache import cache
+
+from .broadcast import LATEST_BROADCAST_KEY, deliver_broadcasts, latest_broadcast_id
+from .models import Notification
+
+NAVBAR_SIZE = 5
+NAVBAR_TIMEOUT = 60 * 10
+# Snapshots are patched in place on every change, which also refreshes the
+# cache timeout. The unread counter is reconciled against the database once
+# a snapshot is this old, so a missed update (e.g. a concurrent write or an
+# admin edit) can only stay visible for a bounded time.
+NAVBAR_RECONCILE_AFTER = 60 * 10
+
+
+def navbar_key(user_id):
+    return f'notifications:navbar:{user_id}'
+
+
+def _item(notification):
+    """The fields base.html shows for one dropdown entry"""
+    return {
+        'id': notification.pk,
+        'title': notification.title,
+        'message': notification.message,
+        'icon': notification.icon,
+        'created_at': notification.created_at,
+        'is_read': not notification.unread,
+    }
+
+
+def get_navbar_snapshot(user):
+    """
+    Return {'unread_count': int, 'latest': [item, ...]} for the navbar,
+    building it from the database only on a cache miss or after a new
+    broadcast, which is delivered to the user first.
+    """
+    key = navbar_key(user.pk)
+    cached = cache.get_many([key, LATEST_BROADCAST_KEY])
+    snapshot = cached.get(key)
+    latest_broadcast = cached.get(LATEST_BROADCAST_KEY)
+    if latest_broadcast is None:
+        latest_broadcast = latest_broadcast_id()
+
+    if (snapshot is not None
+            and snapshot['broadcast_id'] >= latest_broadcast
+            and time.time() - snapshot['built_at'] < NAVBAR_RECONCILE_AFTER):
+        return snapshot
+
+    deliver_broadcasts(user, latest_broadcast)
+    latest = Notification.objects.filter(user=user).with_read_state(user).order_by('-created_at')
+    snapshot = {
+        'unread_count': Notification.objects.unread_for(user).count(),
+        'latest': [_item(n) for n in latest[:NAVBAR_SIZE]],
+        'broadcast_id': latest_broadcast,
+        'built_at': time.time(),
+    }
+    cache.set(key, snapshot, NAVBAR_TIMEOUT)
+    return snapshot
+
+
+def unread_count(user):
+    """Cached unread counter, the same number the navbar badge shows"""
+    return get_navbar_snapshot(user)['unread_count']
+
+
+def _update(user_id, change):
+    key = navbar_key(user_id)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        # Nothing cached yet; the next page view builds a fresh snapshot
+        return
+    if change(snapshot) is False:
+        cache.delete(key)
+    else:
+        cache.set(key, snapshot, NAVBAR_TIMEOUT)
+
+
+def navbar_add(notification):
+    """A notification was created"""
+    def change(snapshot):
+        snapshot['latest'] = ([_item(notification)] + snapshot['latest'])[:NAVBAR_SIZE]
+        if notification.unread:
+            snapshot['unread_count'] += 1
+    _update(notification.user_id, change)
+
+
+def navbar_add_many(notifications):
+    """Several notifications were created, possibly for many users"""
+    by_user = {}
+    for notification in notifications:
+        by_user.setdefault(notification.user_id, []).append(notification)
+    
+    snapshots = cache.get_many([navbar_key(user_id) for user_id in by_user])
+    if not snapshots:
+        return
+    for user_id, added in by_user.items():
+        snapshot = snapshots.get(navbar_key(user_id))
+        if snapshot is None:
+            continue
+        newest_first = [_item(n) for n in reversed(added)]
+        snapshot['latest'] = (newest_first + snapshot['latest'])[:NAVBAR_SIZE]
+        snapshot['unread_count'] += sum(1 for n in added if n.unread)
+    cache.set_many(snapshots, NAVBAR_TIMEOUT)
+
+
+def navbar_mark_read(notification):
+    """A single notification went from unread to read"""
+    def change(snapshot):
+        snapshot['unread_count'] = max(0, snapshot['unread_count'] - 1)
+        for item in snapshot['latest']:
+            if item['id'] == notification.pk:
+                item['is_read'] = True
+    _update(notification.user_id, change)
+
+
+def navbar_mark_all_read(user_id):
+    def change(snapshot):
+        snapshot['unread_count'] = 0
+        for item in snapshot['latest']:
+            item['is_read'] = True
+    _update(user_id, change)
+
+
+def navbar_remove(notification):
+    """A notification was deleted"""
+    def change(snapshot):
+        if any(item['id'] == notification.pk for item in snapshot['latest']):
+            # The dropdown needs a replacement row, so rebuild on next read
+            return False
+        if notification.unread:
+            snapshot['unread_count'] = max(0, snapshot['unread_count'] - 1)
+    _update(notification.user_id, change)
+
+
+def navbar_clear(user_id):
+    def change(snapshot):
+        snapshot['unread_count'] = 0
+        snapshot['latest'] = []
+    _update(user_id, change)
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+
+from . import leases
+from .models import OutboxMessage
+from .replay import remember_events
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 200
+SEND_TIMEOUT = 2  # seconds per group_send
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 2  # seconds, doubled on every attempt
+# How long a dispatcher owns the messages it claimed; pushes in a batch run
+# concurrently, so this is well above SEND_TIMEOUT
+OUTBOX_LEASE = timedelta(seconds=30)
+
+BREAKER_KEY = 'notifications:outbox:breaker'
+BREAKER_THRESHOLD = 3  # consecutive failed batches before the breaker opens
+BREAKER_COOLDOWN = 30  # seconds the breaker stays open
+
+
+def enqueue(group, event):
+    """Queue one channel-layer message; call inside the writing transaction"""
+    return OutboxMessage.objects.create(group=group, event=event)
+
+
+def enqueue_many(messages):
+    """Queue several (group, event) pairs with one INSERT"""
+    return OutboxMessage.objects.bulk_create(
+        [OutboxMessage(group=group, event=event) for group, event in messages]
+    )
+
+
+class CircuitBreaker:
+    """
+    Stops the dispatcher from hammering an unavailable channel layer.
+
+    State lives in the cache so every dispatcher process shares it.
+    """
+
+    def __init__(self, key=BREAKER_KEY, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.key = key
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+    def _state(self):
+        return cache.get(self.key) or {'failures': 0, 'open_until': 0}
+
+    def is_open(self):
+        return self._state()['open_until'] > time.time()
+
+    def record_success(self):
+        cache.delete(self.key)
+
+    def record_failure(self):
+        state = self._state()
+        state['failures'] += 1
+        if state['failures'] >= self.threshold:
+            state['open_until'] = time.time() + self.cooldown
+            state['failures'] = 0
+            logger.error('Channel layer unavailable, pausing outbox dispatch for %ss', self.cooldown)
+        cache.set(self.key, state, None)
+
+
+async def _push(messages, timeout=SEND_TIMEOUT):
+    """group_send every message concurrently, returns a success flag per message"""
+    channel_layer = get_channel_layer()
+
+    async def send(message):
+        try:
+            await asyncio.wait_for(channel_layer.group_send(message.group, message.event), timeout)
+            return True
+        except Exception as exc:
+            logger.warning('Outbox message %s to %s failed: %r', message.pk, message.group, exc)
+            return False
+
+    return await asyncio.gather(*[send(message) for message in messages])
+
+
+def _remember(messages):
+    """
+    Feed per-user notification events to the reconnect replay buffer. This
+    happens before the push so a client that drops mid-push can resume.
+    """
+    events_by_user = {}
+    for message in messages:
+        if message.attempts:
+            continue  # already recorded on its first attempt
+        if message.group.startswith('user_') and 'seq' in message.event:
+            user_id = int(message.group[len('user_'):])
+            events_by_user.setdefault(user_id, []).append(message.event)
+    remember_events(events_by_user)
+
+
+def claim_outbox(batch_size=OUTBOX_BATCH_SIZE, now=None):
+    """Lease up to `batch_size` due messages for OUTBOX_LEASE, see leases.claim"""
+    return leases.claim(OutboxMessage.objects.all(), batch_size, OUTBOX_LEASE, now)
+
+
+def dispatch_outbox(batch_size=OUTBOX_BATCH_SIZE, breaker=None):
+    """
+    Push one batch of due outbox messages. Returns how many were sent.
+
+    The batch is leased first and pushed outside any transaction, so
+    several dispatchers can run side by side and no row lock is held
+    while waiting on the channel layer. Failed messages are retried with
+    exponential backoff and dropped after MAX_ATTEMPTS; the notification
+    itself is already saved, only the live push is lost.
+    """
+    breaker = breaker or CircuitBreaker()
+    if breaker.is_open():
+        return 0
+
+    messages = claim_outbox(batch_size)
+    if not messages:
+        return 0
+
+    _remember(messages)
+    results = async_to_sync(_push)(messages)
+    sent = [message.pk for message, ok in zip(messages, results) if ok]
+
+    leases.settle(messages, sent, MAX_ATTEMPTS, RETRY_DELAY)
+
+    if sent:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    return len(sent)
+
+
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE, breaker=None):
+    """Dispatch batches until the outbox is empty, blocked, or failing"""
+    breaker = breaker or CircuitBreaker()
+    total = 0
+    while True:
+        sent = dispatch_outbox(batch_size, breaker)
+        total += sent
+        if sent < batch_size:
+            return total
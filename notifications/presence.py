@@ -0,0 +1,71 @@
+from django.core.cache import cache
+
+from task_manager.task_metrics import incr_counter
+
+# Each open NotificationConsumer counts as one connection for its user.
+# Consumers refresh the TTL every PRESENCE_HEARTBEAT seconds, so a count
+# left behind by a crashed worker expires on its own.
+PRESENCE_TTL = 90
+PRESENCE_HEARTBEAT = 30
+
+STATS_KEYS = {
+    'hits': 'notifications:presence:hits',
+    'misses': 'notifications:presence:misses',
+}
+
+
+def presence_key(user_id):
+    return f'notifications:presence:{user_id}'
+
+
+async def connected(user_id):
+    key = presence_key(user_id)
+    if await cache.aadd(key, 1, PRESENCE_TTL):
+        return
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        # Expired between the add and the incr
+        await cache.aadd(key, 1, PRESENCE_TTL)
+    await cache.atouch(key, PRESENCE_TTL)
+
+
+async def heartbeat(user_id):
+    await cache.atouch(presence_key(user_id), PRESENCE_TTL)
+
+
+async def disconnected(user_id):
+    key = presence_key(user_id)
+    try:
+        remaining = await cache.adecr(key)
+    except ValueError:
+        return
+    if remaining <= 0:
+        await cache.adelete(key)
+
+
+def _count(name, amount):
+    if not amount:
+        return
+    incr_counter(STATS_KEYS[name], amount)
+
+
+def online_user_ids(user_ids):
+    """The subset of user_ids with at least one open socket, one cache read"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return set()
+    found = cache.get_many([presence_key(user_id) for user_id in user_ids])
+    online = {user_id for user_id in user_ids if found.get(presence_key(user_id), 0) > 0}
+    _count('hits', len(online))
+    _count('misses', len(user_ids) - len(online))
+    return online
+
+
+def presence_stats():
+    """How many push attempts found the user online (hits) or skipped them (misses)"""
+    values = cache.get_many(list(STATS_KEYS.values()))
+    stats = {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+    checked = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / checked, 3) if checked else None
+    return stats
@@ -0,0 +1,57 @@
+"""
+Wake-ups for due/overdue reminders.
+
+Every open task with a due date has at most two reminder moments:
+due_date - DUE_SOON and due_date. Instead of polling for them, the
+earliest pending moment is scheduled as a Celery ETA run of
+check_due_tasks, which sends whatever has arrived and schedules the next
+one. The partial reminder index on Task makes finding that moment a
+single index lookup.
+"""
+from datetime import timedelta
+
+from django.db.models import Min
+from django.utils import timezone
+
+from tasks.models import Task, TaskStats
+from . import wakeups
+
+DUE_SOON = timedelta(hours=24)
+WAKEUP_KEY = 'notifications:reminders:wakeup'
+
+
+def next_reminder_at(task):
+    """When the task's next unsent reminder is due, or None"""
+    if task.status not in TaskStats.OPEN_STATUSES or not task.due_date:
+        return None
+    now = timezone.now()
+    if task.reminder_state == '' and now < task.due_date:
+        # Already inside the due-soon window: remind right away
+        return max(task.due_date - DUE_SOON, now)
+    if task.reminder_state != 'overdue':
+        return task.due_date
+    return None
+
+
+def earliest_pending_reminder(now):
+    """The next moment any reminder becomes due, after `now`"""
+    open_tasks = Task.objects.filter(status__in=TaskStats.OPEN_STATUSES)
+    due = open_tasks.filter(reminder_state='', due_date__gt=now + DUE_SOON).aggregate(
+        at=Min('due_date')
+    )['at']
+    overdue = open_tasks.filter(reminder_state__in=['', 'due'], due_date__gt=now).aggregate(
+        at=Min('due_date')
+    )['at']
+    moments = [at for at in (due and due - DUE_SOON, overdue) if at]
+    return min(moments) if moments else None
+
+
+def schedule_wakeup(at):
+    """Make sure check_due_tasks runs at `at`, see wakeups.schedule_wakeup"""
+    from .tasks import check_due_tasks
+
+    return wakeups.schedule_wakeup(check_due_tasks, WAKEUP_KEY, at)
+
+
+def is_cancelled(token):
+    return wakeups.is_cancelled(WAKEUP_KEY, token)
@@ -0,0 +1,64 @@
+from django.core.cache import cache
+
+from .models import Notification
+
+# Every pushed notification carries seq = its id, which only grows. A client
+# reconnecting with resume_from=<last seq seen> gets the gap replayed from a
+# short per-user ring buffer, or from one indexed query if the ring does not
+# reach back far enough.
+REPLAY_BUFFER_SIZE = 50
+REPLAY_TIMEOUT = 60 * 60 * 24
+REPLAY_LIMIT = 50
+
+
+def replay_key(user_id):
+    return f'notifications:replay:{user_id}'
+
+
+def remember_events(events_by_user):
+    """
+    Append pushed notification events ({user_id: [event, ...]}) to each
+    user's ring buffer, with one cache read and one write for the batch.
+
+    `floor` is the newest seq known to be missing from the ring: the ring
+    holds every event after it, so only gaps starting at or above it can
+    be served from the cache.
+    """
+    if not events_by_user:
+        return
+    keys = {user_id: replay_key(user_id) for user_id in events_by_user}
+    rings = cache.get_many(list(keys.values()))
+    for user_id, events in events_by_user.items():
+        events = sorted(events, key=lambda event: event['seq'])
+        ring = rings.get(keys[user_id]) or {'floor': events[0]['seq'] - 1, 'events': []}
+        ring['events'].extend(events)
+        overflow = len(ring['events']) - REPLAY_BUFFER_SIZE
+        if overflow > 0:
+            ring['floor'] = ring['events'][overflow - 1]['seq']
+            del ring['events'][:overflow]
+        rings[keys[user_id]] = ring
+    cache.set_many(rings, REPLAY_TIMEOUT)
+
+
+def forget_events(user_ids):
+    """
+    Drop the ring of users whose events were not pushed, so a later
+    resume falls back to the database instead of trusting a gappy ring.
+    """
+    if user_ids:
+        cache.delete_many([replay_key(user_id) for user_id in user_ids])
+
+
+def missed_events(user, resume_from):
+    """
+    Channel-layer events for the user's notifications with seq above
+    resume_from, oldest first and at most REPLAY_LIMIT of them.
+    """
+    from .utils import notification_event
+    ring = cache.get(replay_key(user.pk))
+    if ring is not None and resume_from >= ring['floor']:
+        events = [event for event in ring['events'] if event['seq'] > resume_from]
+        return events[-REPLAY_LIMIT:]
+
+    notifications = Notification.objects.filter(user=user, pk__gt=resume_from).order_by('-pk')
+    return [notification_event(n) for n in reversed(notifications[:REPLAY_LIMIT])]
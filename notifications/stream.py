@@ -0,0 +1,117 @@
+import asyncio
+import json
+import time
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+
+from . import presence
+from .broadcast import BROADCAST_GROUP, deliver_broadcasts
+from .navbar import unread_count
+from .replay import missed_events
+
+LONG_POLL_TIMEOUT = 25  # seconds, below common proxy idle timeouts
+KEEPALIVE = 15  # seconds between SSE comments on an idle stream
+
+
+def client_event(event):
+    """The payload clients get for a send_notification channel message"""
+    return {'type': 'notification', 'seq': event['seq'], 'notification': event['notification']}
+
+
+class Subscription:
+    """
+    Async context manager that joins the user's channel-layer groups and
+    marks them online, like an open NotificationConsumer would.
+
+    Waiting in receive() is a pure asyncio wait on the channel layer, so an
+    idle stream or poll holds no worker thread.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.channel_layer = get_channel_layer()
+        self.groups = [f'user_{user.pk}', BROADCAST_GROUP]
+        self.last_heartbeat = 0
+
+    async def __aenter__(self):
+        self.channel = await self.channel_layer.new_channel()
+        for group in self.groups:
+            await self.channel_layer.group_add(group, self.channel)
+        await presence.connected(self.user.pk)
+        self.last_heartbeat = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for group in self.groups:
+            await self.channel_layer.group_discard(group, self.channel)
+        await presence.disconnected(self.user.pk)
+
+    async def receive(self, timeout):
+        """Client events for the next channel message that has any, [] on timeout"""
+        if time.monotonic() - self.last_heartbeat >= presence.PRESENCE_HEARTBEAT:
+            await presence.heartbeat(self.user.pk)
+            self.last_heartbeat = time.monotonic()
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    self.channel_layer.receive(self.channel), max(0, deadline - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                return []
+
+            if message['type'] == 'send_notification':
+                return [client_event(message)]
+            if message['type'] == 'send_unread_count':
+                count = await database_sync_to_async(unread_count)(self.user)
+                return [{'type': 'unread_count', 'count': count}]
+            if message['type'] == 'send_broadcast':
+                # The copy comes back through the user group like any push
+                await database_sync_to_async(deliver_broadcasts)(self.user, message['broadcast_id'])
+
+
+@database_sync_to_async
+def _missed(user, since):
+    return [client_event(event) for event in missed_events(user, since)]
+
+
+def sse_message(event):
+    lines = []
+    if 'seq' in event:
+        # Browsers send this back as Last-Event-ID when they reconnect
+        lines.append(f"id: {event['seq']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+async def sse_events(user, since=None):
+    """Server-Sent Events: the unread count, any replayed gap, then live events"""
+    async with Subscription(user) as subscription:
+        count = await database_sync_to_async(unread_count)(user)
+        yield sse_message({'type': 'unread_count', 'count': count})
+        if since is not None:
+            for event in await _missed(user, since):
+                yield sse_message(event)
+
+        while True:
+            events = await subscription.receive(KEEPALIVE)
+            if not events:
+                yield ': keepalive\n\n'
+            for event in events:
+                yield sse_message(event)
+
+
+async def long_poll(user, since=None, timeout=None):
+    """
+    Client events after `since`, waiting up to LONG_POLL_TIMEOUT for the
+    next one when nothing was missed. Returns [] on timeout.
+    """
+    async with Subscription(user) as subscription:
+        # Subscribed before looking at the gap, so nothing slips in between
+        if since is not None:
+            events = await _missed(user, since)
+            if events:
+                return events
+        return await subscription.receive(LONG_POLL_TIMEOUT if timeout is None else timeout)
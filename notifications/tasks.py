@@ -1,59 +1,235 @@
-from celery import shared_task
+import math
+import time
+from celery import group, shared_task
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import timedelta
-from tasks.models import Task
-from .utils import notify_task_due_soon, notify_task_overdue
+from django.db import transaction
+from django.db.models import Max, Min
+from tasks.models import Task, TaskStats
+from .models import Notification
+from .navbar import navbar_add_many
+from .email import (SUMMARY_TITLE, delivery_cancelled, drain_emails, next_email_at, queue_digests,
+                    queue_reminder_emails, schedule_delivery)
+from .outbox import drain_outbox
+from .reminders import DUE_SOON, earliest_pending_reminder, is_cancelled, schedule_wakeup
+from .retention import purge_expired_notifications
+from .utils import build_task_notification, create_notifications, send_real_time_notifications
+
+OPEN_STATUSES = ['pending', 'in_progress']
+REMINDER_CHUNK_SIZE = 500
+
+# reminder_state -> (notification type, title, message)
+REMINDERS = {
+    'due': ('task_due', 'Task Due Soon', 'Task "{title}" is due soon.'),
+    'overdue': ('task_overdue', 'Task Overdue', 'Task "{title}" is overdue.'),
+}
+
+def pending_reminders(state, now):
+    """Open tasks that have entered `state` but were not yet notified for it"""
+    tasks = Task.objects.filter(status__in=OPEN_STATUSES)
+    if state == 'due':
+        return tasks.filter(
+            reminder_state='',
+            due_date__gt=now,
+            due_date__lte=now + DUE_SOON,
+        )
+    return tasks.filter(reminder_state__in=['', 'due'], due_date__lt=now)
+
+def send_reminders(state, now, chunk_size=REMINDER_CHUNK_SIZE):
+    """
+    Notify every task that transitioned into `state`, one chunk at a time:
+    one read, a bulk INSERT, an UPDATE, an outbox INSERT and, for users
+    who get reminder emails, a user read and an email INSERT per chunk.
+
+    Each chunk is claimed with SKIP LOCKED in the transaction that marks
+    it, so a redelivered or overlapping run never reminds a task twice.
+    """
+    notification_type, title, message = REMINDERS[state]
+    queryset = pending_reminders(state, now).order_by('pk')
+    sent = emailed = 0
+    last_pk = 0
+    
+    while True:
+        with transaction.atomic():
+            chunk = list(
+                queryset.filter(pk__gt=last_pk).select_for_update(skip_locked=True)
+                .only('id', 'user_id', 'title')[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            
+            notifications = Notification.objects.bulk_create([
+                build_task_notification(task, notification_type, title, message.format(title=task.title))
+                for task in chunk
+            ])
+            Task.objects.filter(pk__in=[task.pk for task in chunk]).update(reminder_state=state)
+            send_real_time_notifications(notifications)
+            emailed += len(queue_reminder_emails(notifications))
+        
+        navbar_add_many(notifications)
+        sent += len(chunk)
+    
+    if emailed:
+        transaction.on_commit(deliver_queued_emails.delay)
+    return sent
 
 @shared_task
-def check_due_tasks():
-    """Check for tasks that are due soon or overdue"""
+def check_due_tasks(token=None):
+    """
+    Notify tasks that became due soon or overdue, then schedule the next
+    run for the moment the next reminder is due.
+
+    Runs with a token are wake-ups sent by schedule_wakeup and exit early
+    if a newer wake-up has replaced them. A plain beat run (no token) only
+    acts as a safety net for lost wake-ups, so it can be infrequent.
+    """
+    if token and is_cancelled(token):
+        return "Skipped cancelled reminder wake-up"
     now = timezone.now()
     
-    # Tasks due in next 24 hours
-    due_soon_threshold = now + timedelta(hours=24)
-    due_soon_tasks = Task.objects.filter(
-        due_date__lte=due_soon_threshold,
-        due_date__gt=now,
-        status__in=['pending', 'in_progress']
-    )
-    
-    for task in due_soon_tasks:
-        notify_task_due_soon(task)
+    # Overdue first, so a task that skipped the due-soon window only gets one reminder
+    overdue = send_reminders('overdue', now)
+    due_soon = send_reminders('due', now)
     
-    # Overdue tasks
-    overdue_tasks = Task.objects.filter(
-        due_date__lt=now,
-        status__in=['pending', 'in_progress']
-    )
+    next_at = earliest_pending_reminder(now)
+    if next_at is not None:
+        schedule_wakeup(next_at)
+    return f"Sent {due_soon} due soon and {overdue} overdue reminders, next check at {next_at}"
+
+SUMMARY_CHUNK_SIZE = 1000
+
+def summary_message(pending_tasks, overdue_tasks):
+    message = f"You have {pending_tasks} pending tasks"
+    if overdue_tasks > 0:
+        message += f" and {overdue_tasks} overdue tasks"
+    return message
+
+@shared_task
+def send_daily_summary(shards=1):
+    """
+    Send daily summary notification to users.
+
+    With shards > 1 the active user id range is split into that many
+    slices, each handled by its own send_daily_summary_range task.
+    """
+    bounds = User.objects.filter(is_active=True).aggregate(low=Min('id'), high=Max('id'))
+    low, high = bounds['low'], bounds['high']
+    if low is None:
+        return "No active users"
     
-    for task in overdue_tasks:
-        notify_task_overdue(task)
+    if shards <= 1:
+        return send_daily_summary_range(low, high)
     
-    return f"Checked {due_soon_tasks.count()} due soon and {overdue_tasks.count()} overdue tasks"
+    step = math.ceil((high - low + 1) / shards)
+    ranges = [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+    group(send_daily_summary_range.s(start, end) for start, end in ranges).apply_async()
+    return f"Daily summary split into {len(ranges)} shards"
 
-@shared_task
-def send_daily_summary():
-    """Send daily summary notification to users"""
-    from django.contrib.auth.models import User
-    from .utils import create_notification
-    
-    for user in User.objects.filter(is_active=True):
-        pending_tasks = Task.objects.filter(user=user, status='pending').count()
-        overdue_tasks = Task.objects.filter(
-            user=user,
-            due_date__lt=timezone.now(),
-            status__in=['pending', 'in_progress']
-        ).count()
+@shared_task(bind=True)
+def send_daily_summary_range(self, start_id, end_id, chunk_size=SUMMARY_CHUNK_SIZE):
+    """
+    Summarize users with start_id <= id <= end_id.
+
+    Counts come from the per-user TaskStats rows, so each chunk is one
+    indexed read, one bulk INSERT and one batched push, regardless of how
+    many users or tasks it covers. Rows whose overdue count went stale
+    since a due date passed are recounted together first.
+    """
+    started = time.monotonic()
+    now = timezone.now()
+    users = User.objects.filter(is_active=True, pk__range=(start_id, end_id)).order_by('pk').values_list(
+        'pk', 'task_stats__pending', 'task_stats__overdue', 'task_stats__next_due_at'
+    )
+    
+    processed = 0
+    last_pk = start_id - 1
+    while True:
+        rows = list(users.filter(pk__gt=last_pk)[:chunk_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
         
-        message = f"You have {pending_tasks} pending tasks"
-        if overdue_tasks > 0:
-            message += f" and {overdue_tasks} overdue tasks"
+        counts = {pk: (pending, overdue) for pk, pending, overdue, _ in rows}
+        for pk, pending, _, _ in rows:
+            if pending is None:
+                # No stats row yet (an account older than TaskStats)
+                stats = TaskStats.rebuild(User(pk=pk))
+                counts[pk] = (stats.pending, stats.overdue)
+        stale = [pk for pk, pending, _, next_due_at in rows
+                 if pending is not None and next_due_at and next_due_at <= now]
+        if stale:
+            for pk, overdue in TaskStats.refresh_overdue_many(stale, now).items():
+                counts[pk] = (counts[pk][0], overdue)
         
-        create_notification(
-            user=user,
-            notification_type='system',
-            title='Daily Task Summary',
-            message=message
-        )
+        create_notifications([
+            Notification(
+                user_id=pk,
+                notification_type='system',
+                title=SUMMARY_TITLE,
+                message=summary_message(pending, overdue)
+            )
+            for pk, (pending, overdue) in counts.items()
+        ])
+        processed += len(rows)
+        
+        if self.request.id:
+            self.update_state(state='PROGRESS', meta={
+                'start_id': start_id,
+                'end_id': end_id,
+                'last_id': last_pk,
+                'processed': processed,
+                'elapsed': round(time.monotonic() - started, 3),
+            })
     
-    return "Daily summary sent to all users"
\ No newline at end of file
+    elapsed = time.monotonic() - started
+    rate = processed / elapsed if elapsed else 0
+    return (f"Daily summary sent to {processed} users (ids {start_id}-{end_id}) "
+            f"in {elapsed:.2f}s ({rate:.0f} users/s)")
+
+@shared_task
+def dispatch_notification_outbox():
+    """
+    Push queued real-time notifications. Schedule it every few seconds
+    with celery beat, or run `manage.py dispatch_outbox` for lower latency.
+    """
+    return f"Dispatched {drain_outbox()} outbox messages"
+
+@shared_task
+def purge_notifications(max_seconds=None):
+    """
+    Enforce NOTIFICATION_EXPIRE_DAYS. Meant to run nightly; each run is a
+    slice of at most max_seconds that re-queues itself until the backlog
+    is gone, so other batch work gets a turn in between.
+    """
+    max_seconds = max_seconds or settings.BATCH_TASK_SLICE_SECONDS
+    report = purge_expired_notifications(max_seconds=max_seconds)
+    if report['remaining']:
+        purge_notifications.apply_async(kwargs={'max_seconds': max_seconds})
+    return (f"Purged {report['purged']} notifications in {report['elapsed']}s "
+            f"({report['rows_per_second']} rows/s), {report['remaining']} remaining")
+
+@shared_task
+def deliver_queued_emails(token=None):
+    """
+    Send queued emails in batches, one SMTP connection per batch. If
+    retries are left waiting, schedule the next run for when they are due;
+    runs with a token are those wake-ups and exit if a newer one replaced
+    them, so only one retry chain exists.
+    """
+    if token and delivery_cancelled(token):
+        return "Skipped cancelled email wake-up"
+    sent = drain_emails()
+    next_at = next_email_at()
+    if next_at is not None:
+        schedule_delivery(next_at)
+    return f"Sent {sent} emails, next delivery at {next_at}"
+
+@shared_task
+def send_email_digests():
+    """Queue and send the daily digest for users who chose digest emails"""
+    queued = queue_digests()
+    if queued:
+        transaction.on_commit(deliver_queued_emails.delay)
+    return f"Queued {queued} email digests"
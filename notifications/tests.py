@@ -1,3 +1,945 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import re
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from task_manager.testing import (IsolatedTestCase, LocalSMTPServer, QueryBudgetTestCase, seed_notifications,
+                                  seed_tasks)
+from tasks.models import Task, TaskStats
+from . import presence
+from .bench import compare
+from .broadcast import BROADCAST_GROUP
+from .email import (EMAIL_LEASE, EMAIL_RETRY_DELAY, EMAIL_WAKEUP_KEY, MAX_EMAIL_ATTEMPTS, claim_emails, deliver_emails,
+                    drain_emails, queue_digests, queue_email)
+from .consumers import COALESCE_WINDOW, PROTOCOL_JSON, PROTOCOL_MSGPACK, SEND_QUEUE_LIMIT, NotificationConsumer
+from .models import ArchivedNotification, EmailPreference, Notification, OutboxMessage, QueuedEmail
+from .navbar import get_navbar_snapshot
+from .outbox import OUTBOX_LEASE, CircuitBreaker, claim_outbox, dispatch_outbox, drain_outbox, enqueue
+from .reminders import DUE_SOON, WAKEUP_KEY
+from .replay import missed_events
+from .stream import long_poll, sse_events
+from .retention import archive_path, purge_expired_notifications
+from .utils import create_notification, notify_all_users
+from .wakeups import max_wakeup_delay
+
+
+class NotificationViewQueryBudgetTests(QueryBudgetTestCase):
+    def test_pages_read_the_navbar_from_its_snapshot(self):
+        cache.clear()
+        # Latest broadcast id, the dropdown rows and the unread count
+        with self.assertNumQueries(3):
+            get_navbar_snapshot(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_navbar_snapshot(self.user)['unread_count'], 10)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('dashboard'))
+        self.assertEqual([query['sql'] for query in ctx.captured_queries if 'notifications_' in query['sql']], [])
+
+    def test_notification_list(self):
+        self.assertWithinBudget('notification_list')
+
+    def test_anonymous_pages_do_not_open_the_notification_socket(self):
+        self.assertContains(self.client.get(reverse('dashboard')), '/ws/notifications/')
+        self.client.logout()
+        self.assertNotContains(self.client.get(reverse('home')), '/ws/notifications/')
+
+    def test_notification_count(self):
+        self.assertWithinBudget('notification_count')
+
+    def test_notification_feed(self):
+        self.assertWithinBudget('notification_feed', data={'read': 'unread', 'type': 'system'})
+
+    def test_notification_count_reads_the_cached_counter(self):
+        url = reverse('notification_count')
+        self.assertEqual(self.client.get(url).json()['count'], 10)
+
+        create_notification(self.user, 'system', 'Hello', 'World')
+        self.notifications[0].mark_as_read()
+        # Session and user only, the counter comes from the cache
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).json()['count'], 10)
+
+    def test_mark_as_read(self):
+        pk = self.notifications[0].pk
+        self.assertWithinBudget('mark_notification_read', kwargs={'pk': pk})
+        self.assertWithinBudget('mark_notification_read', kwargs={'pk': pk},
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_mark_all_as_read(self):
+        self.assertWithinBudget('mark_all_notifications_read')
+
+    def test_delete_notification(self):
+        self.assertWithinBudget('delete_notification', kwargs={'pk': self.notifications[0].pk})
+
+    def test_clear_all(self):
+        self.assertWithinBudget('clear_all_notifications')
+
+    def test_notification_stream_long_poll_returns_missed_events_at_once(self):
+        notification = create_notification(self.user, 'system', 'Hello', 'World')
+        response = self.assertWithinBudget(
+            'notification_stream', data={'mode': 'poll', 'since': self.notifications[-1].pk}
+        )
+        self.assertEqual([event['seq'] for event in response.json()['events']], [notification.pk])
+
+    def test_presence_stats_view_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('presence_stats')).status_code, 302)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertWithinBudget('presence_stats')
+
+    def test_email_preferences(self):
+        self.assertWithinBudget('email_preferences')
+        self.assertWithinBudget('email_preferences', method='post', data={'mode': 'digest'})
+        preference = EmailPreference.objects.get(user=self.user)
+        self.assertEqual((preference.mode, preference.digest_through), ('digest', self.notifications[-1].pk))
+
+
+class NavbarSnapshotTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('navbar', password='x')
+        cls.notifications = seed_notifications(cls.user, 10)
+
+    def setUp(self):
+        super().setUp()
+        get_navbar_snapshot(self.user)
+        self.client.force_login(self.user)
+
+    def snapshot(self):
+        with self.assertNumQueries(0):
+            return get_navbar_snapshot(self.user)
+
+    def test_create_patches_the_snapshot(self):
+        notification = create_notification(self.user, 'system', 'Hello', 'World')
+        snapshot = self.snapshot()
+        self.assertEqual(snapshot['unread_count'], 11)
+        self.assertEqual(snapshot['latest'][0]['id'], notification.pk)
+        self.assertEqual(len(snapshot['latest']), 5)
+
+    def test_read_and_read_all_patch_the_snapshot(self):
+        newest = self.notifications[-1]
+        Notification.objects.with_read_state(self.user).get(pk=newest.pk).mark_as_read()
+        snapshot = self.snapshot()
+        self.assertEqual(snapshot['unread_count'], 9)
+        self.assertTrue(snapshot['latest'][0]['is_read'])
+
+        Notification.mark_all_as_read(self.user)
+        snapshot = self.snapshot()
+        self.assertEqual(snapshot['unread_count'], 0)
+        self.assertTrue(all(item['is_read'] for item in snapshot['latest']))
+
+    def test_deleting_a_listed_notification_rebuilds(self):
+        self.client.get(reverse('delete_notification', kwargs={'pk': self.notifications[-1].pk}))
+        # The dropdown rows and the unread count; the broadcast id stays cached
+        with self.assertNumQueries(2):
+            snapshot = get_navbar_snapshot(self.user)
+        self.assertEqual(snapshot['unread_count'], 9)
+        self.assertEqual(snapshot['latest'][0]['id'], self.notifications[-2].pk)
+
+        self.client.get(reverse('clear_all_notifications'))
+        self.assertEqual(self.snapshot(), {**snapshot, 'unread_count': 0, 'latest': []})
+
+
+class NotificationFeedTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', password='x')
+        cls.notifications = seed_notifications(cls.user, 10)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_feed_pages_through_everything_once(self):
+        for i in range(25):
+            create_notification(self.user, 'task_created', f'Extra {i}', 'More')
+
+        response = self.client.get(reverse('notification_list'))
+        seen = [n.pk for n in response.context['notifications']]
+        cursor = response.context['notifications'].next_cursor
+        while cursor:
+            data = self.client.get(reverse('notification_feed'), {'cursor': cursor}).json()
+            seen += [int(pk) for pk in re.findall(r'/notifications/(\d+)/delete/', data['html'])]
+            cursor = data['next_cursor']
+
+        self.assertEqual(len(seen), 35)
+        self.assertEqual(set(seen), set(Notification.objects.filter(user=self.user).values_list('pk', flat=True)))
+
+    def test_filters(self):
+        create_notification(self.user, 'task_created', 'Extra', 'More')
+        self.notifications[0].mark_as_read()
+
+        response = self.client.get(reverse('notification_list'), {'type': 'task_created'})
+        self.assertEqual([n.title for n in response.context['notifications']], ['Extra'])
+        response = self.client.get(reverse('notification_list'), {'read': 'read'})
+        self.assertEqual([n.pk for n in response.context['notifications']], [self.notifications[0].pk])
+        Notification.mark_all_as_read(self.user)
+        response = self.client.get(reverse('notification_list'), {'read': 'unread'})
+        self.assertFalse(response.context['notifications'])
+
+
+class ReadWatermarkTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', password='x')
+        cls.notifications = seed_notifications(cls.user, 3)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_mark_all_does_not_rewrite_rows(self):
+        self.client.get(reverse('mark_all_notifications_read'))
+
+        self.assertEqual(Notification.objects.filter(user=self.user, is_read=False).count(), 3)
+        self.assertFalse(Notification.objects.unread_for(self.user).exists())
+        response = self.client.get(reverse('notification_list'))
+        self.assertFalse(any(n.unread for n in response.context['notifications']))
+
+    def test_newer_notifications_stay_unread(self):
+        Notification.mark_all_as_read(self.user)
+        newer = create_notification(self.user, 'system', 'Hello', 'World')
+
+        self.assertEqual(list(Notification.objects.unread_for(self.user)), [newer])
+        self.assertEqual(self.client.get(reverse('notification_count')).json()['count'], 1)
+
+    def test_mark_as_read_below_watermark_keeps_count(self):
+        create_notification(self.user, 'system', 'Hello', 'World')
+        Notification.mark_all_as_read(self.user)
+        create_notification(self.user, 'system', 'Hello', 'Again')
+        self.assertEqual(self.client.get(reverse('notification_count')).json()['count'], 1)
+
+        self.client.get(reverse('mark_notification_read', kwargs={'pk': self.notifications[0].pk}))
+        self.assertEqual(self.client.get(reverse('notification_count')).json()['count'], 1)
+
+
+class CheckDueTasksTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reminded', password='x')
+        seed_tasks(cls.user, 30)
+
+    def setUp(self):
+        super().setUp()
+        from .tasks import check_due_tasks
+
+        patcher = mock.patch.object(check_due_tasks, 'apply_async')
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_transition_notifies_once(self):
+        from .tasks import check_due_tasks
+
+        check_due_tasks()
+        overdue = Notification.objects.filter(notification_type='task_overdue').count()
+        due = Notification.objects.filter(notification_type='task_due').count()
+        # Seeded tasks are due at -10..+19 days; only open ones are reminded
+        self.assertEqual(overdue, Task.objects.filter(
+            status__in=['pending', 'in_progress'], due_date__lt=timezone.now()).count())
+        self.assertEqual(due, Task.objects.filter(
+            status__in=['pending', 'in_progress'], due_date__gt=timezone.now(),
+            due_date__lte=timezone.now() + timedelta(hours=24)).count())
+
+        check_due_tasks()
+        self.assertEqual(Notification.objects.filter(notification_type='task_overdue').count(), overdue)
+        self.assertEqual(Notification.objects.filter(notification_type='task_due').count(), due)
+
+    def test_new_due_date_rearms_reminders(self):
+        from .tasks import check_due_tasks
+
+        task = Task.objects.filter(status='pending', due_date__lt=timezone.now()).first()
+        check_due_tasks()
+        task.refresh_from_db()
+        self.assertEqual(task.reminder_state, 'overdue')
+
+        task.due_date = timezone.now() + timedelta(hours=2)
+        task.save()
+        self.assertEqual(task.reminder_state, '')
+        check_due_tasks()
+        self.assertTrue(Notification.objects.filter(
+            notification_type='task_due', related_id=task.pk).exists())
+
+    def test_saving_a_task_schedules_its_reminder(self):
+        due_date = timezone.now() + timedelta(days=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(user=self.user, title='Later', due_date=due_date)
+
+        wakeup = cache.get(WAKEUP_KEY)
+        self.apply_async.assert_called_once_with(kwargs={'token': wakeup['token']}, eta=wakeup['at'])
+        # Days ahead, so the wake-up is capped inside the broker's visibility timeout
+        self.assertLess(wakeup['at'], due_date - DUE_SOON)
+        self.assertLessEqual(wakeup['at'], timezone.now() + max_wakeup_delay())
+
+        # A later reminder is covered by the wake-up already scheduled
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(user=self.user, title='Even later', due_date=due_date + timedelta(days=1))
+        self.assertEqual(self.apply_async.call_count, 1)
+
+    def test_run_schedules_next_reminder_and_skips_cancelled_wakeups(self):
+        from .tasks import check_due_tasks
+
+        check_due_tasks()
+        # Seeded open tasks are due every day; the next one enters the due-soon window first
+        next_due = Task.objects.filter(
+            status__in=['pending', 'in_progress'], due_date__gt=timezone.now() + DUE_SOON,
+        ).order_by('due_date').first().due_date
+        self.assertEqual(
+            self.apply_async.call_args.kwargs['eta'].replace(microsecond=0),
+            min(next_due - DUE_SOON, timezone.now() + max_wakeup_delay()).replace(microsecond=0),
+        )
+
+        cache.set(WAKEUP_KEY, {'at': timezone.now(), 'token': 'newer'})
+        with self.assertNumQueries(0):
+            self.assertEqual(check_due_tasks(token='older'), 'Skipped cancelled reminder wake-up')
+
+    def test_wakeups_chain(self):
+        from .tasks import check_due_tasks
+
+        check_due_tasks()
+        first = self.apply_async.call_args.kwargs
+        # The first wake-up's own marker must not cover the one it schedules next
+        with mock.patch('django.utils.timezone.now', return_value=first['eta'] + timedelta(seconds=1)):
+            check_due_tasks(**first['kwargs'])
+        second = self.apply_async.call_args.kwargs
+        self.assertEqual(self.apply_async.call_count, 2)
+        self.assertGreater(second['eta'], first['eta'])
+        self.assertNotEqual(second['kwargs']['token'], first['kwargs']['token'])
+        self.assertEqual(cache.get(WAKEUP_KEY)['token'], second['kwargs']['token'])
+
+    def test_far_off_reminder_is_reached_by_rechaining(self):
+        from .tasks import check_due_tasks
+
+        Task.objects.all().delete()
+        due_date = timezone.now() + timedelta(days=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            task = Task.objects.create(user=self.user, title='Later', due_date=due_date)
+
+        etas = [task.created_at]
+        while not Notification.objects.filter(related_id=task.pk).exists():
+            wakeup = self.apply_async.call_args.kwargs
+            etas.append(wakeup['eta'])
+            with mock.patch('django.utils.timezone.now', return_value=wakeup['eta'] + timedelta(seconds=1)):
+                check_due_tasks(**wakeup['kwargs'])
+        # Every hop (sent a second after the previous ETA) stayed inside the visibility timeout
+        self.assertGreater(len(etas), 2)
+        self.assertLessEqual(max(b - a for a, b in zip(etas, etas[1:])), max_wakeup_delay() + timedelta(seconds=1))
+        self.assertGreaterEqual(etas[-1], due_date - DUE_SOON)
+
+    def test_redelivered_wakeup_does_not_remind_twice(self):
+        from .tasks import check_due_tasks
+
+        check_due_tasks(token='same')
+        sent = Notification.objects.filter(notification_type__in=['task_due', 'task_overdue']).count()
+        # A second copy of the same message carries the same token
+        check_due_tasks(token='same')
+        self.assertEqual(
+            Notification.objects.filter(notification_type__in=['task_due', 'task_overdue']).count(), sent
+        )
+
+    def test_task_due_within_the_window_gets_the_due_reminder(self):
+        from .tasks import check_due_tasks
+
+        with self.captureOnCommitCallbacks(execute=True):
+            task = Task.objects.create(user=self.user, title='Soon', due_date=timezone.now() + timedelta(hours=5))
+        wakeup = self.apply_async.call_args.kwargs
+        self.assertLessEqual(wakeup['eta'], timezone.now())
+
+        check_due_tasks(**wakeup['kwargs'])
+        self.assertEqual(list(Notification.objects.filter(related_id=task.pk).values_list(
+            'notification_type', flat=True)), ['task_due'])
+
+
+class DailySummaryTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('summarised', password='x')
+        seed_tasks(cls.user, 30)
+
+    def test_summary_counts(self):
+        from .tasks import send_daily_summary, summary_message
+
+        send_daily_summary()
+        summary = Notification.objects.get(user=self.user, title='Daily Task Summary')
+        pending = Task.objects.filter(user=self.user, status='pending').count()
+        overdue = Task.objects.filter(
+            user=self.user, status__in=['pending', 'in_progress'], due_date__lt=timezone.now()).count()
+        self.assertEqual(summary.message, summary_message(pending, overdue))
+
+    def test_query_count_does_not_grow_with_users(self):
+        from .tasks import send_daily_summary
+
+        for i in range(20):
+            User.objects.create_user(f'idle{i}', password='x')
+        TaskStats.rebuild(self.user)
+        # id bounds, one TaskStats chunk, savepoint, notification insert,
+        # release, the empty final chunk; nobody is online to push to
+        with self.assertNumQueries(6):
+            send_daily_summary()
+        self.assertEqual(Notification.objects.filter(title='Daily Task Summary').count(), 21)
+
+    def test_stale_overdue_counts_are_recounted_together(self):
+        from .tasks import send_daily_summary
+
+        TaskStats.objects.filter(user=self.user).update(overdue=0, next_due_at=timezone.now() - timedelta(days=1))
+        send_daily_summary()
+        summary = Notification.objects.get(user=self.user, title='Daily Task Summary')
+        overdue = Task.objects.filter(
+            user=self.user, status__in=['pending', 'in_progress'], due_date__lt=timezone.now()).count()
+        self.assertIn(f'and {overdue} overdue tasks', summary.message)
+        self.assertEqual(TaskStats.objects.get(user=self.user).overdue, overdue)
+
+
+class BroadcastTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('listener', password='x')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_broadcast_cost_does_not_grow_with_users(self):
+        for i in range(20):
+            User.objects.create_user(f'reader{i}', password='x')
+        # savepoint, broadcast and outbox inserts, release
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(4):
+                notify_all_users('Maintenance', 'Back in five minutes')
+        self.assertFalse(Notification.objects.filter(title='Maintenance').exists())
+        self.assertEqual(OutboxMessage.objects.filter(group=BROADCAST_GROUP).count(), 1)
+
+    def test_delivered_once_on_next_page_view(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_all_users('Maintenance', 'Back in five minutes')
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['unread_notifications_count'], 1)
+        delivered = Notification.objects.get(user=self.user, title='Maintenance')
+
+        # Deleting the copy must not bring the broadcast back
+        delivered.delete()
+        self.client.get(reverse('dashboard'))
+        self.assertFalse(Notification.objects.filter(user=self.user, title='Maintenance').exists())
+
+    def test_new_users_skip_older_broadcasts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_all_users('Maintenance', 'Back in five minutes')
+        User.objects.create_user('latecomer', password='x')
+        self.client.login(username='latecomer', password='x')
+
+        self.client.get(reverse('dashboard'))
+        self.assertFalse(Notification.objects.filter(user__username='latecomer').exists())
+
+    async def test_every_tab_gets_the_broadcast(self):
+        tabs = []
+        for _ in range(2):
+            tab = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+            tab.scope['user'] = self.user
+            await tab.connect()
+            await tab.receive_json_from()  # unread count
+            tabs.append(tab)
+
+        await database_sync_to_async(notify_all_users)('Maintenance', 'Back in five minutes')
+        await database_sync_to_async(drain_outbox)()
+        # Both sockets race to deliver it; only one copy is made, pushed to the user group
+        copies = OutboxMessage.objects.filter(group=f'user_{self.user.pk}')
+        for _ in range(100):
+            if await copies.aexists():
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        await database_sync_to_async(drain_outbox)()
+
+        for tab in tabs:
+            event = await tab.receive_json_from()
+            self.assertEqual(event['notification']['title'], 'Maintenance')
+            self.assertTrue(await tab.receive_nothing())
+            await tab.disconnect()
+        self.assertEqual(await Notification.objects.filter(title='Maintenance').acount(), 1)
+
+
+class OutboxTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('online', password='x')
+
+    def setUp(self):
+        super().setUp()
+        async_to_sync(presence.connected)(self.user.pk)
+
+    def receive(self, channel_layer, channel):
+        return async_to_sync(channel_layer.receive)(channel)
+
+    def test_notification_push_waits_for_dispatcher(self):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f'user_{self.user.pk}', channel)
+
+        notification = create_notification(self.user, 'system', 'Hello', 'World')
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+        self.assertEqual(drain_outbox(), 1)
+        self.assertFalse(OutboxMessage.objects.exists())
+        event = self.receive(channel_layer, channel)
+        self.assertEqual(event['notification']['id'], notification.pk)
+
+    def test_rolled_back_notification_is_not_queued(self):
+        try:
+            with transaction.atomic():
+                create_notification(self.user, 'system', 'Hello', 'World')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_failures_retry_then_open_breaker(self):
+        enqueue(f'user_{self.user.pk}', {'type': 'send_notification'})
+        breaker = CircuitBreaker(threshold=2)
+        with mock.patch('notifications.outbox._push', side_effect=self.failing_push):
+            self.assertEqual(dispatch_outbox(breaker=breaker), 0)
+            message = OutboxMessage.objects.get()
+            self.assertEqual(message.attempts, 1)
+            self.assertGreater(message.available_at, timezone.now())
+
+            OutboxMessage.objects.update(available_at=timezone.now())
+            dispatch_outbox(breaker=breaker)
+        self.assertTrue(breaker.is_open())
+        # An open breaker leaves the queue alone
+        OutboxMessage.objects.update(available_at=timezone.now())
+        self.assertEqual(dispatch_outbox(breaker=breaker), 0)
+        self.assertEqual(OutboxMessage.objects.get().attempts, 2)
+
+    def test_messages_are_leased_while_pushing(self):
+        enqueue(f'user_{self.user.pk}', {'type': 'send_notification'})
+        claimed_meanwhile = []
+
+        async def push(messages):
+            # Another dispatcher running now finds nothing to take
+            claimed_meanwhile.extend(await database_sync_to_async(claim_outbox)())
+            return [True] * len(messages)
+
+        with mock.patch('notifications.outbox._push', side_effect=push):
+            self.assertEqual(dispatch_outbox(), 1)
+        self.assertEqual(claimed_meanwhile, [])
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_expired_lease_is_claimed_again(self):
+        message = enqueue(f'user_{self.user.pk}', {'type': 'send_notification'})
+        self.assertEqual(claim_outbox(), [message])
+        self.assertEqual(claim_outbox(), [])
+        self.assertEqual(claim_outbox(now=timezone.now() + OUTBOX_LEASE), [message])
+
+    @staticmethod
+    async def failing_push(messages):
+        return [False] * len(messages)
+
+
+class RetentionTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('retained', password='x')
+        cls.notifications = seed_notifications(cls.user, 10)
+
+    def setUp(self):
+        super().setUp()
+        # The six oldest seeded notifications are past retention
+        expired = [n.pk for n in self.notifications[:6]]
+        Notification.objects.filter(pk__in=expired).update(
+            created_at=timezone.now() - timedelta(days=40)
+        )
+
+    def test_purge_in_batches_and_archive_to_table(self):
+        report = purge_expired_notifications(archive='table', batch_size=4, pause=0)
+
+        self.assertEqual(report['purged'], 6)
+        self.assertEqual(report['batches'], 2)
+        self.assertEqual(report['remaining'], 0)
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(
+            set(ArchivedNotification.objects.values_list('pk', flat=True)),
+            {n.pk for n in self.notifications[:6]},
+        )
+
+    def test_stopping_early_reports_backlog(self):
+        report = purge_expired_notifications(batch_size=4, pause=0, max_seconds=0)
+        self.assertEqual(report['purged'], 4)
+        self.assertEqual(report['remaining'], 2)
+        self.assertFalse(ArchivedNotification.objects.exists())
+
+    def test_archive_to_jsonl(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            with self.settings(NOTIFICATION_ARCHIVE_DIR=archive_dir):
+                purge_expired_notifications(archive='jsonl', pause=0)
+                with gzip.open(archive_path(), 'rt') as archive:
+                    rows = [json.loads(line) for line in archive]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]['id'], self.notifications[0].pk)
+
+
+class BatchedProtocolTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('batched', password='x')
+        seed_notifications(cls.user, 2)
+
+    async def connect(self, protocol):
+        communicator = WebsocketCommunicator(
+            NotificationConsumer.as_asgi(), '/ws/notifications/', subprotocols=[protocol]
+        )
+        communicator.scope['user'] = self.user
+        connected, accepted = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(accepted, protocol)
+        return communicator
+
+    async def push(self, count):
+        channel_layer = get_channel_layer()
+        for i in range(count):
+            await channel_layer.group_send(f'user_{self.user.pk}', {
+                'type': 'send_notification',
+                'seq': i,
+                'notification': {'id': i, 'title': f'Burst {i}'},
+            })
+
+    async def test_burst_is_one_frame(self):
+        communicator = await self.connect(PROTOCOL_JSON)
+        first = json.loads(await communicator.receive_from())
+        self.assertEqual(first['events'], [{'type': 'unread_count', 'count': 2}])
+
+        await self.push(5)
+        frame = json.loads(await communicator.receive_from())
+        self.assertEqual(frame['type'], 'batch')
+        self.assertEqual([event['notification']['id'] for event in frame['events']], list(range(5)))
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_msgpack_frames_and_queue_cap(self):
+        communicator = await self.connect(PROTOCOL_MSGPACK)
+        await communicator.receive_output()  # unread count
+
+        with mock.patch('notifications.consumers.SEND_QUEUE_LIMIT', 3):
+            await self.push(5)
+            output = await communicator.receive_output()
+        frame = msgpack.unpackb(output['bytes'])
+        self.assertEqual(frame['dropped'], 2)
+        self.assertEqual([event['notification']['id'] for event in frame['events']], [2, 3, 4])
+        await communicator.disconnect()
+
+    async def test_slow_client_waits_in_the_capped_queue(self):
+        consumer = NotificationConsumer()
+        consumer.protocol = PROTOCOL_JSON
+        consumer.send_queue, consumer.dropped, consumer.flush_task = [], 0, None
+        frames = []
+        delivered = asyncio.Event()
+
+        async def slow_send(text_data=None, bytes_data=None):
+            frames.append(json.loads(text_data))
+            await delivered.wait()
+
+        consumer.send = slow_send
+        await consumer.send_event({'n': 0})
+        await asyncio.sleep(COALESCE_WINDOW * 2)
+        for n in range(1, SEND_QUEUE_LIMIT + 51):
+            await consumer.send_event({'n': n})
+        await asyncio.sleep(COALESCE_WINDOW * 2)
+        # No second frame while the first is still being sent
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(len(consumer.send_queue), SEND_QUEUE_LIMIT)
+
+        delivered.set()
+        await asyncio.sleep(COALESCE_WINDOW * 2)
+        self.assertEqual(frames[1]['dropped'], 50)
+        self.assertEqual([event['n'] for event in frames[1]['events']], list(range(51, SEND_QUEUE_LIMIT + 51)))
+        self.assertIsNone(consumer.flush_task)
+
+
+class ReplayTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('replayed', password='x')
+        cls.notifications = seed_notifications(cls.user, 10)
+
+    def setUp(self):
+        super().setUp()
+        async_to_sync(presence.connected)(self.user.pk)
+        self.last_seen = self.notifications[-1].pk
+        self.missed = [create_notification(self.user, 'system', f'Missed {i}', 'x') for i in range(3)]
+        drain_outbox()
+
+    def test_gap_is_served_from_the_ring_buffer(self):
+        with self.assertNumQueries(0):
+            events = missed_events(self.user, self.last_seen)
+        self.assertEqual([event['seq'] for event in events], [n.pk for n in self.missed])
+
+    def test_gap_older_than_the_ring_falls_back_to_one_query(self):
+        with self.assertNumQueries(1):
+            events = missed_events(self.user, self.notifications[4].pk)
+        self.assertEqual(len(events), 5 + 3)
+
+    async def test_reconnect_replays_only_the_gap(self):
+        communicator = WebsocketCommunicator(
+            NotificationConsumer.as_asgi(), f'/ws/notifications/?resume_from={self.missed[0].pk}'
+        )
+        communicator.scope['user'] = self.user
+        await communicator.connect()
+        await communicator.receive_json_from()  # unread count
+
+        replayed = [await communicator.receive_json_from() for _ in range(2)]
+        self.assertEqual([event['seq'] for event in replayed], [n.pk for n in self.missed[1:]])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class PresenceTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('present', password='x')
+
+    def test_offline_users_are_not_queued(self):
+        create_notification(self.user, 'system', 'Hello', 'World')
+        self.assertFalse(OutboxMessage.objects.exists())
+
+        async_to_sync(presence.connected)(self.user.pk)
+        create_notification(self.user, 'system', 'Hello', 'Again')
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+        async_to_sync(presence.disconnected)(self.user.pk)
+        create_notification(self.user, 'system', 'Hello', 'Gone')
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+        self.assertEqual(presence.presence_stats(), {'hits': 1, 'misses': 2, 'hit_rate': 0.333})
+
+    def test_connection_count(self):
+        async_to_sync(presence.connected)(self.user.pk)
+        async_to_sync(presence.connected)(self.user.pk)
+        async_to_sync(presence.disconnected)(self.user.pk)
+        self.assertEqual(presence.online_user_ids([self.user.pk]), {self.user.pk})
+        async_to_sync(presence.disconnected)(self.user.pk)
+        self.assertEqual(presence.online_user_ids([self.user.pk]), set())
+
+    async def test_consumer_tracks_presence(self):
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+        communicator.scope['user'] = self.user
+        await communicator.connect()
+        self.assertEqual(await cache.aget(presence.presence_key(self.user.pk)), 1)
+        await communicator.disconnect()
+        self.assertIsNone(await cache.aget(presence.presence_key(self.user.pk)))
+
+
+class NotificationStreamTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('streamed', password='x')
+        cls.notifications = seed_notifications(cls.user, 3)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    async def test_long_poll_waits_for_the_next_push(self):
+        async def push_soon():
+            await asyncio.sleep(0.05)
+            await get_channel_layer().group_send(f'user_{self.user.pk}', {
+                'type': 'send_notification', 'seq': 99, 'notification': {'id': 99},
+            })
+
+        pusher = asyncio.ensure_future(push_soon())
+        events = await long_poll(self.user, timeout=5)
+        await pusher
+        self.assertEqual(events, [{'type': 'notification', 'seq': 99, 'notification': {'id': 99}}])
+        self.assertEqual(await long_poll(self.user, timeout=0.01), [])
+
+    async def test_reads_in_another_tab_update_the_count(self):
+        def read_elsewhere():
+            Notification.objects.get(pk=self.notifications[0].pk).mark_as_read()
+            dispatch_outbox()
+
+        async def read_soon():
+            await asyncio.sleep(0.05)
+            await database_sync_to_async(read_elsewhere)()
+
+        reader = asyncio.ensure_future(read_soon())
+        events = await long_poll(self.user, timeout=5)
+        await reader
+        self.assertEqual(events, [{'type': 'unread_count', 'count': 2}])
+
+    def test_deletes_update_the_count_in_other_tabs(self):
+        async_to_sync(presence.connected)(self.user.pk)
+        refresh = {'group': f'user_{self.user.pk}', 'event': {'type': 'send_unread_count'}}
+
+        self.client.post(reverse('delete_notification', kwargs={'pk': self.notifications[0].pk}))
+        self.assertEqual(list(OutboxMessage.objects.values('group', 'event')), [refresh])
+
+        OutboxMessage.objects.all().delete()
+        self.client.post(reverse('clear_all_notifications'))
+        self.assertEqual(list(OutboxMessage.objects.values('group', 'event')), [refresh])
+
+    async def test_sse_stream(self):
+        stream = sse_events(self.user)
+        self.assertEqual(await stream.__anext__(), 'event: unread_count\ndata: {"type":"unread_count","count":3}\n\n')
+        self.assertIn(self.user.pk, presence.online_user_ids([self.user.pk]))
+
+        await get_channel_layer().group_send(f'user_{self.user.pk}', {
+            'type': 'send_notification', 'seq': 7, 'notification': {'id': 7},
+        })
+        message = await stream.__anext__()
+        self.assertTrue(message.startswith('id: 7\nevent: notification\n'))
+
+        await stream.aclose()
+        self.assertEqual(presence.online_user_ids([self.user.pk]), set())
+
+    async def test_view_is_awaited_on_the_event_loop(self):
+        from task_manager.query_budget import QueryBudgetMiddleware
+
+        def parked_threads():
+            """Threads sitting in the sync middleware while the view waits"""
+            parked = []
+            for thread_id, frame in sys._current_frames().items():
+                while frame:
+                    if frame.f_code is QueryBudgetMiddleware.__call__.__code__:
+                        parked.append(thread_id)
+                    frame = frame.f_back
+            return parked
+
+        waits = []
+
+        async def fake_long_poll(user, since=None, timeout=None):
+            waits.append((threading.current_thread(), parked_threads()))
+            return []
+
+        await self.async_client.aforce_login(self.user)
+        with mock.patch('notifications.views.long_poll', fake_long_poll):
+            response = await self.async_client.get(reverse('notification_stream'), {'mode': 'poll'})
+        self.assertEqual(response.json(), {'events': []})
+        # Awaited on the test's event loop, with no thread blocked behind an adapter
+        self.assertEqual(waits, [(threading.current_thread(), [])])
+        # The query budget still sees the session and auth queries
+        self.assertGreater(response.asgi_request.query_count, 0)
+
+
+class BenchmarkCommandTests(IsolatedTestCase):
+    def test_reports_every_delivered_notification(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            call_command('bench_notifications', connections=5, bursts=2, burst_size=10,
+                         protocol=PROTOCOL_MSGPACK, output=output.name, stdout=mock.MagicMock())
+            report = json.load(output)
+
+        self.assertEqual(report['params']['protocol'], PROTOCOL_MSGPACK)
+        self.assertEqual(report['results']['delivered'], 20)
+        self.assertLessEqual(report['results']['latency_ms']['p50'], report['results']['latency_ms']['p99'])
+        self.assertEqual(compare(report, report)['delivered'], 0.0)
+
+
+class EmailDeliveryTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('mailed', 'mailed@example.com', 'x')
+        seed_tasks(cls.user, 12)
+
+    def setUp(self):
+        super().setUp()
+        from .tasks import check_due_tasks
+
+        patcher = mock.patch.object(check_due_tasks, 'apply_async')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batch_shares_one_connection(self):
+        for i in range(3):
+            queue_email(f'user{i}@example.com', f'Subject {i}', 'Body')
+        with LocalSMTPServer() as smtp, self.settings(**smtp.email_settings()):
+            self.assertEqual(drain_emails(), 3)
+        self.assertEqual(smtp.connections, 1)
+        self.assertEqual([recipients for recipients, _ in smtp.messages],
+                         [['user0@example.com'], ['user1@example.com'], ['user2@example.com']])
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_refused_emails_retry_with_backoff_then_drop(self):
+        queue_email('good@example.com', 'Hello', 'Body')
+        bad = queue_email('bad@example.com', 'Hello', 'Body')
+        last_try = queue_email('gone@example.com', 'Hello', 'Body')
+        QueuedEmail.objects.filter(pk=last_try.pk).update(attempts=MAX_EMAIL_ATTEMPTS - 1)
+
+        with LocalSMTPServer() as smtp, self.settings(**smtp.email_settings()):
+            smtp.reject = {'bad@example.com', 'gone@example.com'}
+            self.assertEqual(deliver_emails(), 1)
+
+        bad.refresh_from_db()
+        self.assertEqual(bad.attempts, 1)
+        self.assertGreater(bad.available_at, timezone.now() + timedelta(seconds=EMAIL_RETRY_DELAY - 5))
+        self.assertEqual(list(QueuedEmail.objects.all()), [bad])
+
+    def test_claimed_emails_are_leased(self):
+        email = queue_email('user@example.com', 'Hello', 'Body')
+        self.assertEqual(claim_emails(), [email])
+        # Leased rows are invisible to other senders until the lease runs out
+        self.assertEqual(claim_emails(), [])
+        self.assertEqual(claim_emails(now=timezone.now() + EMAIL_LEASE), [email])
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 2)
+
+    def test_one_retry_wakeup_however_many_runs(self):
+        from .tasks import deliver_queued_emails
+
+        queue_email('bad@example.com', 'Hello', 'Body')
+        with LocalSMTPServer() as smtp, self.settings(**smtp.email_settings()), \
+                mock.patch.object(deliver_queued_emails, 'apply_async') as apply_async:
+            smtp.reject = {'bad@example.com'}
+            deliver_queued_emails()
+            queue_email('later@example.com', 'Hello', 'Body')
+            deliver_queued_emails()
+            apply_async.assert_called_once()
+            token = apply_async.call_args.kwargs['kwargs']['token']
+
+            cache.set(EMAIL_WAKEUP_KEY, {'at': timezone.now(), 'token': 'newer'})
+            self.assertEqual(deliver_queued_emails(token=token), 'Skipped cancelled email wake-up')
+        self.assertEqual([recipients for recipients, _ in smtp.messages], [['later@example.com']])
+
+    def test_reminder_emails_are_opt_in(self):
+        from .tasks import check_due_tasks
+
+        check_due_tasks()
+        self.assertTrue(Notification.objects.filter(notification_type__in=['task_due', 'task_overdue']).exists())
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_instant_reminder_emails(self):
+        from .tasks import check_due_tasks
+
+        EmailPreference.objects.create(user=self.user, mode='instant')
+        check_due_tasks()
+        reminders = Notification.objects.filter(notification_type__in=['task_due', 'task_overdue'])
+        self.assertEqual(QueuedEmail.objects.filter(to=self.user.email).count(), reminders.count())
+
+    def test_daily_digest_merges_reminders_and_summary(self):
+        from .tasks import check_due_tasks, send_daily_summary
+
+        EmailPreference.objects.create(user=self.user, mode='digest')
+        check_due_tasks()
+        send_daily_summary()
+        self.assertFalse(QueuedEmail.objects.exists())
+
+        self.assertEqual(queue_digests(), 1)
+        digest = QueuedEmail.objects.get()
+        self.assertEqual(digest.to, self.user.email)
+        self.assertIn('Overdue:', digest.body)
+        self.assertIn('Summary:\n- You have', digest.body)
+        # Nothing new since the last digest
+        self.assertEqual(queue_digests(), 0)
@@ -3,9 +3,13 @@ from . import views
 
 urlpatterns = [
     path('', views.notification_list, name='notification_list'),
+    path('feed/', views.notification_feed, name='notification_feed'),
     path('<int:pk>/mark-read/', views.mark_as_read, name='mark_notification_read'),
     path('mark-all-read/', views.mark_all_as_read, name='mark_all_notifications_read'),
     path('<int:pk>/delete/', views.delete_notification, name='delete_notification'),
     path('clear-all/', views.clear_all, name='clear_all_notifications'),
     path('count/', views.notification_count, name='notification_count'),
+    path('stream/', views.notification_stream, name='notification_stream'),
+    path('presence/', views.presence_stats, name='presence_stats'),
+    path('email/', views.email_preferences, name='email_preferences'),
 ]
\ No newline at end of file
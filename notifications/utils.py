@@ -1,47 +1,98 @@
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from django.contrib.auth.models import User
+from django.db import transaction
 from .models import Notification
-from django.utils import timezone
-import json
+from .navbar import navbar_add, navbar_add_many
+from .broadcast import send_broadcast
+from .outbox import enqueue, enqueue_many
+from .presence import online_user_ids
+from .replay import forget_events
 
 def create_notification(user, notification_type, title, message, related_id=None, related_url=''):
-    """Create and send real-time notification"""
+    """Create a notification and queue its real-time push"""
     
-    # Create notification in database
-    notification = Notification.objects.create(
-        user=user,
-        notification_type=notification_type,
-        title=title,
-        message=message,
-        related_id=related_id,
-        related_url=related_url
-    )
+    with transaction.atomic():
+        notification = Notification.objects.create(
+            user=user,
+            notification_type=notification_type,
+            title=title,
+            message=message,
+            related_id=related_id,
+            related_url=related_url
+        )
+        send_real_time_notification(user, notification)
     
-    # Send real-time notification via WebSocket
-    send_real_time_notification(user, notification)
+    navbar_add(notification)
     
     return notification
 
-def send_real_time_notification(user, notification):
-    """Send notification through WebSocket"""
-    channel_layer = get_channel_layer()
-    
-    async_to_sync(channel_layer.group_send)(
-        f'user_{user.id}',
-        {
-            'type': 'send_notification',
-            'notification': {
-                'id': notification.id,
-                'type': notification.notification_type,
-                'title': notification.title,
-                'message': notification.message,
-                'icon': notification.icon,
-                'related_url': notification.related_url,
-                'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'is_read': notification.is_read,
-            }
+def create_notifications(notifications):
+    """Insert many unsaved notifications at once and queue their pushes"""
+    with transaction.atomic():
+        notifications = Notification.objects.bulk_create(notifications)
+        send_real_time_notifications(notifications)
+    navbar_add_many(notifications)
+    return notifications
+
+def notification_event(notification):
+    """Channel-layer message for one notification"""
+    return {
+        'type': 'send_notification',
+        'seq': notification.id,
+        'notification': {
+            'id': notification.id,
+            'type': notification.notification_type,
+            'title': notification.title,
+            'message': notification.message,
+            'icon': notification.icon,
+            'related_url': notification.related_url,
+            'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'is_read': notification.is_read,
         }
+    }
+
+def send_real_time_notification(user, notification):
+    """
+    Queue a WebSocket push for the outbox dispatcher, unless the user has
+    no open socket.
+
+    Runs in the caller's transaction, so a rolled back notification is
+    never pushed and a slow channel layer never blocks the request.
+    """
+    if not online_user_ids([user.id]):
+        forget_events([user.id])
+        return
+    enqueue(f'user_{user.id}', notification_event(notification))
+
+def send_real_time_notifications(notifications):
+    """Queue pushes for many notifications with one INSERT, online users only"""
+    if not notifications:
+        return
+    user_ids = {notification.user_id for notification in notifications}
+    online = online_user_ids(user_ids)
+    forget_events(user_ids - online)
+    enqueue_many([
+        (f'user_{notification.user_id}', notification_event(notification))
+        for notification in notifications
+        if notification.user_id in online
+    ])
+
+def send_unread_count(user_id):
+    """
+    Queue an unread-count refresh for the user's open sockets and streams,
+    so a read in one tab updates the badge in the others. Receivers read
+    the count from the navbar snapshot, so call this after updating it.
+    """
+    if online_user_ids([user_id]):
+        enqueue(f'user_{user_id}', {'type': 'send_unread_count'})
+
+def build_task_notification(task, notification_type, title, message):
+    """Unsaved task notification, for use with create_notifications"""
+    return Notification(
+        user_id=task.user_id,
+        notification_type=notification_type,
+        title=title,
+        message=message,
+        related_id=task.id,
+        related_url=f'/tasks/{task.id}/'
     )
 
 def notify_task_created(task):
@@ -99,13 +150,26 @@ def notify_task_overdue(task):
         related_url=f'/tasks/{task.id}/'
     )
 
+def notify_tasks_bulk_updated(user, action, count):
+    """Send one summary notification for a bulk task change"""
+    if not count:
+        return
+    noun = 'task' if count == 1 else 'tasks'
+    summaries = {
+        'complete': ('task_completed', 'Tasks Completed', f'{count} {noun} marked as completed.'),
+        'delete': ('task_updated', 'Tasks Deleted', f'{count} {noun} deleted.'),
+        'priority': ('task_updated', 'Tasks Updated', f'Priority changed on {count} {noun}.'),
+        'category': ('task_updated', 'Tasks Updated', f'Category changed on {count} {noun}.'),
+    }
+    notification_type, title, message = summaries[action]
+    create_notification(
+        user=user,
+        notification_type=notification_type,
+        title=title,
+        message=message,
+        related_url='/tasks/tasks/'
+    )
+
 def notify_all_users(title, message, notification_type='system'):
-    """Send notification to all users"""
-    users = User.objects.filter(is_active=True)
-    for user in users:
-        create_notification(
-            user=user,
-            notification_type=notification_type,
-            title=title,
-            message=message
-        )
\ No newline at end of file
+    """Send notification to all users as a single broadcast"""
+    return send_broadcast(title, message, notification_type)
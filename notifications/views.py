@@ -1,24 +1,84 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from .models import Notification
-from .utils import create_notification
-from django.utils import timezone
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from tasks.pagination import cursor_paginate, InvalidCursor
+from .models import EmailPreference, Notification
+from .utils import create_notification, send_unread_count
+from .navbar import navbar_remove, navbar_clear, unread_count
+from .presence import presence_stats as get_presence_stats
+from .stream import long_poll, sse_events
+
+NOTIFICATIONS_PER_PAGE = 20
+READ_FILTERS = ['unread', 'read']
+
+def _notification_page(request):
+    """
+    One keyset page of the user's notifications plus the active filters.
+
+    Pages are (created_at, id) range scans on the (user, is_read,
+    created_at) index, so deep scrolling costs the same as the first page.
+    """
+    type_filter = request.GET.get('type', '')
+    if type_filter not in dict(Notification.NOTIFICATION_TYPES):
+        type_filter = ''
+    read_filter = request.GET.get('read', '')
+    if read_filter not in READ_FILTERS:
+        read_filter = ''
+    
+    if read_filter == 'unread':
+        notifications = Notification.objects.unread_for(request.user)
+    elif read_filter == 'read':
+        notifications = Notification.objects.read_for(request.user)
+    else:
+        notifications = Notification.objects.filter(user=request.user)
+    if type_filter:
+        notifications = notifications.filter(notification_type=type_filter)
+    notifications = notifications.with_read_state(request.user)
+    
+    try:
+        page = cursor_paginate(notifications, NOTIFICATIONS_PER_PAGE, request.GET.get('cursor'))
+    except InvalidCursor:
+        page = cursor_paginate(notifications, NOTIFICATIONS_PER_PAGE)
+    return page, {'type': type_filter, 'read': read_filter}
 
 @login_required
 def notification_list(request):
-    """View all notifications"""
-    notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
+    """View all notifications, the rest of the list loads while scrolling"""
+    page, filters = _notification_page(request)
     
     return render(request, 'notifications/list.html', {
-        'notifications': notifications,
+        'notifications': page,
+        'filters': filters,
+        'notification_types': Notification.NOTIFICATION_TYPES,
         'active_tab': 'notifications'
     })
 
+@login_required
+def notification_feed(request):
+    """Next slice of the notification list as an HTML fragment (JSON API)"""
+    page, filters = _notification_page(request)
+    # No request, so the navbar context processor is skipped for fragments
+    html = render_to_string('notifications/_notification_items.html', {
+        'notifications': page,
+    })
+    
+    return JsonResponse({
+        'html': html,
+        'count': len(page),
+        'next_cursor': page.next_cursor,
+        'has_next': page.has_next,
+    })
+
 @login_required
 def mark_as_read(request, pk):
     """Mark a notification as read"""
-    notification = get_object_or_404(Notification, pk=pk, user=request.user)
+    notification = get_object_or_404(
+        Notification.objects.with_read_state(request.user), pk=pk, user=request.user
+    )
     notification.mark_as_read()
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -29,10 +89,7 @@ def mark_as_read(request, pk):
 @login_required
 def mark_all_as_read(request):
     """Mark all notifications as read"""
-    Notification.objects.filter(user=request.user, is_read=False).update(
-        is_read=True,
-        read_at=timezone.now()
-    )
+    Notification.mark_all_as_read(request.user)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({'success': True})
@@ -42,8 +99,13 @@ def mark_all_as_read(request):
 @login_required
 def delete_notification(request, pk):
     """Delete a notification"""
-    notification = get_object_or_404(Notification, pk=pk, user=request.user)
+    notification = get_object_or_404(
+        Notification.objects.with_read_state(request.user), pk=pk, user=request.user
+    )
+    navbar_remove(notification)
     notification.delete()
+    if notification.unread:
+        send_unread_count(request.user.pk)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({'success': True})
@@ -54,10 +116,67 @@ def delete_notification(request, pk):
 def clear_all(request):
     """Clear all notifications"""
     Notification.objects.filter(user=request.user).delete()
+    navbar_clear(request.user.id)
+    send_unread_count(request.user.id)
     return redirect('notification_list')
 
 @login_required
 def notification_count(request):
     """Get unread notification count (API endpoint)"""
-    count = Notification.objects.filter(user=request.user, is_read=False).count()
-    return JsonResponse({'count': count})
+    return JsonResponse({'count': unread_count(request.user)})
+
+@login_required
+async def notification_stream(request):
+    """
+    Push channel for clients without a WebSocket. Serves Server-Sent
+    Events by default, or one long-poll response with ?mode=poll.
+
+    Resumes after Last-Event-ID (sent by EventSource on reconnect) or
+    ?since=<seq>.
+    """
+    user = await request.auser()
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        since = None
+    
+    if request.GET.get('mode') == 'poll':
+        return JsonResponse({'events': await long_poll(user, since)})
+    
+    response = StreamingHttpResponse(sse_events(user, since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # keep nginx from buffering the stream
+    return response
+
+@staff_member_required
+def presence_stats(request):
+    """Presence hit/miss counters for skipped real-time pushes (staff only)"""
+    return JsonResponse(get_presence_stats())
+
+@login_required
+def email_preferences(request):
+    """Choose between instant reminder emails, a daily digest or none"""
+    preference = EmailPreference.objects.filter(user=request.user).first()
+    mode = preference.mode if preference else settings.NOTIFICATION_EMAIL_MODE
+    
+    if request.method == 'POST':
+        new_mode = request.POST.get('mode')
+        if new_mode not in dict(EmailPreference.MODE_CHOICES):
+            messages.error(request, 'Please choose a valid email option.')
+        else:
+            preference = preference or EmailPreference(user=request.user)
+            if new_mode == 'digest' and mode != 'digest':
+                # The first digest starts from now, not from the whole history
+                preference.digest_through = Notification.objects.filter(
+                    user=request.user
+                ).order_by('-pk').values_list('pk', flat=True).first() or 0
+            preference.mode = new_mode
+            preference.save()
+            messages.success(request, 'Email preferences saved!')
+            return redirect('email_preferences')
+    
+    return render(request, 'notifications/email_preferences.html', {
+        'mode': mode,
+        'mode_choices': EmailPreference.MODE_CHOICES,
+    })
@@ -0,0 +1,60 @@
+"""
+At most one pending ETA run of a self-rescheduling Celery task.
+
+A cache marker holds the time and token of the pending run. Asking for
+a wake-up that the pending one already covers is a no-op; asking for an
+earlier one sends a new run with a fresh token, and the run it replaced
+finds out through is_cancelled() and exits.
+
+The Redis broker redelivers any message left unacknowledged for longer
+than its visibility_timeout, and an ETA message stays unacknowledged
+until it runs. Wake-ups are therefore never sent further out than half
+that timeout; a run that comes early finds nothing due and schedules the
+next hop, so far-off moments are reached by re-chaining.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+# How long a wake-up marker outlives its ETA, so a late run can still
+# tell whether it was replaced
+WAKEUP_GRACE = timedelta(hours=1)
+
+
+def max_wakeup_delay():
+    """How far ahead a wake-up may be sent, well inside the visibility timeout"""
+    options = getattr(settings, 'CELERY_BROKER_TRANSPORT_OPTIONS', {})
+    return timedelta(seconds=options.get('visibility_timeout', 60 * 60) / 2)
+
+
+def schedule_wakeup(task, key, at):
+    """
+    Make sure `task` runs at `at`, with its token as the `token` kwarg,
+    or by max_wakeup_delay() from now if that is sooner.
+    A wake-up still pending for that moment or earlier covers it. Markers
+    whose time has passed never cover anything: that run is already under
+    way (and is what usually calls this) or was lost.
+    Returns the new token, or None when nothing was sent.
+    """
+    now = timezone.now()
+    at = min(max(at, now), now + max_wakeup_delay())
+    current = cache.get(key)
+    if current and now < current['at'] <= at:
+        return None
+
+    token = uuid.uuid4().hex
+    cache.set(key, {'at': at, 'token': token}, int((at - now + WAKEUP_GRACE).total_seconds()))
+    task.apply_async(kwargs={'token': token}, eta=at)
+    return token
+
+
+def is_cancelled(key, token):
+    """
+    A wake-up is cancelled once another run scheduled for the same time
+    or earlier has replaced its token; that run reschedules what is left.
+    """
+    current = cache.get(key)
+    return bool(current) and current['token'] != token and current['at'] <= timezone.now()
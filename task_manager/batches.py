@@ -0,0 +1,78 @@
+"""
+Time-sliced batch jobs: walk a table in primary-key order, one short
+transaction per batch, pausing or rate limiting in between and stopping
+early after a time budget so the next run picks up the rest. Used by the
+task archive and cleanup jobs and the notification purge.
+"""
+import time
+
+from django.db import transaction
+
+
+class BatchRunner:
+    """
+    Runs batches over one or more querysets under a shared time budget and
+    collects the numbers every job reports.
+
+    Between batches it sleeps for `pause` seconds, or as long as needed to
+    stay under `max_rate` rows per second when that is given.
+    """
+
+    def __init__(self, batch_size, pause=0, max_rate=None, max_seconds=None):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_rate = max_rate
+        self.max_seconds = max_seconds
+        self.started = time.monotonic()
+        self.rows = self.batches = self.remaining = 0
+        self.timed_out = False
+
+    def run(self, queryset, process, atomic=transaction.atomic, lock=False):
+        """
+        Call `process(rows)` for each batch of `queryset`, inside `atomic()`.
+        Rows are values() dicts with an 'id' or values_list() tuples that
+        start with the pk; with `lock` they are read FOR UPDATE.
+        """
+        queryset = queryset.order_by('pk')
+        last_pk = 0
+        while not self.timed_out:
+            with atomic():
+                batch = queryset.filter(pk__gt=last_pk)
+                if lock:
+                    batch = batch.select_for_update()
+                rows = list(batch[:self.batch_size])
+                if not rows:
+                    break
+                last_pk = rows[-1]['id'] if isinstance(rows[-1], dict) else rows[-1][0]
+                process(rows)
+
+            self.rows += len(rows)
+            self.batches += 1
+            if len(rows) < self.batch_size:
+                break
+            self._wait()
+        if self.timed_out:
+            # Only counted when the run stopped early; otherwise nothing is left
+            self.remaining += queryset.filter(pk__gt=last_pk).count()
+
+    def _wait(self):
+        elapsed = time.monotonic() - self.started
+        if self.max_seconds is not None and elapsed >= self.max_seconds:
+            self.timed_out = True
+        elif self.max_rate:
+            ahead = self.rows / self.max_rate - elapsed
+            if ahead > 0:
+                time.sleep(ahead)
+        elif self.pause:
+            time.sleep(self.pause)
+
+    def report(self, **counts):
+        """`counts` followed by the batches, timing and remaining backlog"""
+        elapsed = time.monotonic() - self.started
+        return {
+            **counts,
+            'batches': self.batches,
+            'elapsed': round(elapsed, 3),
+            'rows_per_second': round(self.rows / elapsed) if elapsed else self.rows,
+            'remaining': self.remaining,
+        }
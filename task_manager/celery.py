@@ -8,6 +8,19 @@ app = Celery('task_manager')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+# Queue lag and runtime per task name, see task_metrics()
+from . import task_metrics  # noqa: E402,F401
+
+# Tasks are routed by CELERY_TASK_ROUTES. Run one worker pool per queue so
+# batch work can never occupy the slots interactive tasks need, e.g.:
+#
+#   celery -A task_manager worker -Q interactive -c 8 --prefetch-multiplier 4 -n interactive@%h
+#   celery -A task_manager worker -Q default -c 4 -n default@%h
+#   celery -A task_manager worker -Q batch -c 2 --prefetch-multiplier 1 -O fair -n batch@%h
+#
+# A single worker consuming all three still serves them in priority order
+# (queue_order_strategy in CELERY_BROKER_TRANSPORT_OPTIONS).
+
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
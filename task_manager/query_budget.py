@@ -0,0 +1,92 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """connection.execute_wrapper hook that counts every query it sees"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def get_budget(url_name):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+
+
+def check_budget(url_name, count):
+    """Log (and optionally raise) when a view went over its query budget"""
+    budget = get_budget(url_name)
+    if budget is None or count <= budget:
+        return
+    message = f'View "{url_name}" ran {count} queries (budget {budget})'
+    logger.warning(message)
+    if settings.DEBUG and getattr(settings, 'QUERY_BUDGET_RAISE', False):
+        raise QueryBudgetExceeded(message)
+
+
+class QueryBudgetMiddleware:
+    """
+    Count the queries each request runs and compare them against
+    settings.QUERY_BUDGETS, keyed by URL name.
+
+    The count covers the whole request, including sessions, auth and
+    context processors, which is what the user actually waits on.
+
+    Works both ways, so under ASGI it does not force the chain onto a
+    worker thread: an async view (the notification stream) is awaited on
+    the event loop and an idle stream holds no thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        with connections['default'].execute_wrapper(counter):
+            response = self.get_response(request)
+        self.check(request, counter)
+        return response
+
+    async def __acall__(self, request):
+        # Database connections are per thread; queries run in the request's
+        # thread-sensitive executor, so install the hook there
+        counter = QueryCounter()
+        hook = await sync_to_async(self.install)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(hook.__exit__)(None, None, None)
+        self.check(request, counter)
+        return response
+
+    @staticmethod
+    def install(counter):
+        hook = connections['default'].execute_wrapper(counter)
+        hook.__enter__()
+        return hook
+
+    def check(self, request, counter):
+        match = getattr(request, 'resolver_match', None)
+        if match and match.url_name:
+            request.query_count = counter.count
+            check_budget(match.url_name, counter.count)
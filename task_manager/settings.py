@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 import os
 from pathlib import Path
 import dj_database_url
+from kombu import Queue
 from environs import Env
 
 import cloudinary
@@ -67,6 +68,7 @@ INSTALLED_APPS = [
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
 MIDDLEWARE = [
+    'task_manager.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +90,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'notifications.context_processors.unread_notifications_count',
             ],
         },
     },
@@ -106,6 +109,14 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache (shared by all workers so signal-based invalidation is seen everywhere)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+}
+
 WSGI_APPLICATION = 'task_manager.wsgi.application'
 
 
@@ -192,8 +203,125 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Queues: "interactive" for work a user is waiting on, "default" for
+# time-sensitive background jobs and "batch" for sweeps and cleanups,
+# which run as short slices that re-queue themselves so they interleave.
+CELERY_TASK_QUEUES = (
+    Queue('interactive', routing_key='interactive'),
+    Queue('default', routing_key='default'),
+    Queue('batch', routing_key='batch'),
+)
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+# On Redis 0 is the highest priority
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_TASK_ROUTES = {
+    'tasks.views.send_welcome_email': {'queue': 'interactive', 'priority': 0},
+    'notifications.tasks.dispatch_notification_outbox': {'queue': 'interactive', 'priority': 1},
+    'notifications.tasks.deliver_queued_emails': {'queue': 'default', 'priority': 3},
+    'notifications.tasks.check_due_tasks': {'queue': 'default', 'priority': 2},
+    'notifications.tasks.send_daily_summary': {'queue': 'batch', 'priority': 6},
+    'notifications.tasks.send_daily_summary_range': {'queue': 'batch', 'priority': 6},
+    'notifications.tasks.send_email_digests': {'queue': 'batch', 'priority': 6},
+    'tasks.views.delete_attachment_blobs': {'queue': 'batch', 'priority': 7},
+    'tasks.views.archive_old_tasks': {'queue': 'batch', 'priority': 8},
+    'tasks.views.cleanup_old_tasks': {'queue': 'batch', 'priority': 9},
+    'notifications.tasks.purge_notifications': {'queue': 'batch', 'priority': 9},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    # A worker listening on several queues drains them in the order given
+    'queue_order_strategy': 'priority',
+    # Unacknowledged messages, including ETA runs still waiting, are
+    # redelivered after this long; wake-ups stay well inside it (see
+    # notifications.wakeups)
+    'visibility_timeout': 60 * 60,
+}
+# Workers reserve one message per process, so a long batch slice never
+# sits on prefetched interactive work; see task_manager/celery.py for
+# per-queue worker pools.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# These batch slices are idempotent, so a crashed worker's slice is
+# redelivered rather than lost. Summaries are not: they would be sent twice.
+CELERY_TASK_ANNOTATIONS = {
+    name: {'acks_late': True}
+    for name in (
+        'tasks.views.delete_attachment_blobs',
+        'tasks.views.archive_old_tasks',
+        'tasks.views.cleanup_old_tasks',
+        'notifications.tasks.purge_notifications',
+    )
+}
+# How long one slice of a batch task runs before re-queuing the rest
+BATCH_TASK_SLICE_SECONDS = 60
+
+# Closed tasks untouched for this many days move to the ArchivedTask table,
+# which keeps tasks_task and its indexes small. See tasks.archive.
+TASK_ARCHIVE_DAYS = 30
+
+# Task retention: days since a task was last updated before cleanup_old_tasks
+# deletes it, per status. Open tasks have no rule, so they are never removed.
+TASK_RETENTION_DAYS = {
+    'completed': 60,
+    'cancelled': 60,
+}
+
+# Email. Queued messages go out in batches over one SMTP connection,
+# see notifications.email.
+DEFAULT_FROM_EMAIL = 'admin@taskmanager.com'
+EMAIL_TIMEOUT = 10
+
 # Notification settings
+# Reminder emails for users without an EmailPreference row: 'instant',
+# 'digest' (one daily email, needs a row to track what was sent) or 'off'.
+# Off by default, so users opt in on the email preferences page.
+NOTIFICATION_EMAIL_MODE = 'off'
 NOTIFICATION_EXPIRE_DAYS = 30
+# What purge_expired_notifications does with expired rows before deleting
+# them: '' drops them, 'table' copies them to ArchivedNotification and
+# 'jsonl' appends them to a gzipped JSONL file in NOTIFICATION_ARCHIVE_DIR.
+NOTIFICATION_ARCHIVE = ''
+NOTIFICATION_ARCHIVE_DIR = BASE_DIR / 'archive' / 'notifications'
+
+# Query budgets (max queries per request, keyed by URL name).
+# QueryBudgetMiddleware logs any view that goes over; set
+# QUERY_BUDGET_RAISE to turn that into an exception.
+QUERY_BUDGETS = {
+    # tasks
+    'dashboard': 8,
+    'task_list': 7,
+    'task_create': 12,
+    'task_detail': 8,
+    'task_update': 12,
+    'task_delete': 12,
+    'task_complete': 14,
+    'task_bulk_action': 16,
+    'task_restore': 14,
+    'task_queue_stats': 3,
+    'create_category': 6,
+    'manage_categories': 6,
+    'delete_category': 8,
+    'update_category': 6,
+    'delete_attachment': 8,
+    # notifications
+    'notification_list': 6,
+    'notification_feed': 5,
+    'mark_notification_read': 5,
+    'mark_all_notifications_read': 4,
+    'delete_notification': 8,
+    'clear_all_notifications': 6,
+    'notification_count': 4,
+    'notification_stream': 4,
+    'presence_stats': 3,
+    'email_preferences': 8,
+    # accounts
+    'home': 3,
+    'register': 4,
+    'profile': 7,
+    'account_delete': 7,
+    'account_delete_confirm': 4,
+}
+QUERY_BUDGET_RAISE = False
 
 
 JAZZMIN_SETTINGS = {
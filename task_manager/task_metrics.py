@@ -0,0 +1,86 @@
+import time
+from datetime import datetime
+
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.core.cache import cache
+
+# Per task name: runs, failures, and total/max queue lag and runtime in ms.
+# Kept in the shared cache so every worker adds to the same counters.
+METRIC_FIELDS = ('runs', 'failures', 'lag_total', 'lag_max', 'runtime_total', 'runtime_max')
+
+
+def metric_key(task_name, field):
+    return f'celery:metrics:{task_name}:{field}'
+
+
+def incr_counter(key, amount):
+    """Atomically add `amount` to a cache counter that never expires"""
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        if not cache.add(key, amount, None):
+            cache.incr(key, amount)
+
+
+def _raise_max(key, value):
+    # Not atomic, but a lost update only under-reports a maximum
+    if value > (cache.get(key) or 0):
+        cache.set(key, value, None)
+
+
+def record_lag(task_name, lag_ms):
+    incr_counter(metric_key(task_name, 'lag_total'), lag_ms)
+    _raise_max(metric_key(task_name, 'lag_max'), lag_ms)
+
+
+def record_run(task_name, runtime_ms, failed=False):
+    incr_counter(metric_key(task_name, 'runs'), 1)
+    if failed:
+        incr_counter(metric_key(task_name, 'failures'), 1)
+    incr_counter(metric_key(task_name, 'runtime_total'), runtime_ms)
+    _raise_max(metric_key(task_name, 'runtime_max'), runtime_ms)
+
+
+def task_metrics(task_names):
+    """{task name: metrics} for the given tasks, one cache read"""
+    keys = {metric_key(name, field): (name, field) for name in task_names for field in METRIC_FIELDS}
+    values = cache.get_many(list(keys))
+    metrics = {}
+    for key, (name, field) in keys.items():
+        metrics.setdefault(name, {})[field] = values.get(key, 0)
+    for name, stats in metrics.items():
+        runs = stats['runs']
+        stats['lag_avg'] = round(stats['lag_total'] / runs) if runs else None
+        stats['runtime_avg'] = round(stats['runtime_total'] / runs) if runs else None
+    return {name: stats for name, stats in metrics.items() if stats['runs']}
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    # Custom headers end up as attributes of task.request on the worker
+    if headers is not None:
+        headers.setdefault('published_at', time.time())
+
+
+@task_prerun.connect
+def measure_queue_lag(task=None, **kwargs):
+    task.request.started_at = time.monotonic()
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is None:
+        return
+    # ETA and countdown tasks only start waiting in the queue once due
+    eta = task.request.eta
+    if isinstance(eta, str):
+        eta = datetime.fromisoformat(eta)
+    if eta:
+        published_at = max(published_at, eta.timestamp())
+    record_lag(task.name, max(0, round((time.time() - published_at) * 1000)))
+
+
+@task_postrun.connect
+def measure_runtime(task=None, state=None, **kwargs):
+    started_at = getattr(task.request, 'started_at', None)
+    if started_at is None:
+        return
+    runtime = round((time.monotonic() - started_at) * 1000)
+    record_run(task.name, runtime, failed=state == 'FAILURE')
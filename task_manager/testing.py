@@ -0,0 +1,192 @@
+import socketserver
+import threading
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from task_manager.query_budget import get_budget
+
+TEST_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def seed_tasks(user, count, categories=()):
+    """
+    `count` tasks for `user`, cycling through statuses, priorities and
+    `categories`, due one a day starting ten days ago.
+    """
+    from tasks.models import Task
+
+    now = timezone.now()
+    statuses = ['pending', 'in_progress', 'completed']
+    priorities = ['low', 'medium', 'high']
+    return [
+        Task.objects.create(
+            user=user,
+            title=f'Task {i}',
+            description=f'Description for task {i}',
+            status=statuses[i % 3],
+            priority=priorities[i % 3],
+            category=categories[i % len(categories)] if categories else None,
+            due_date=now + timedelta(days=i - 10),
+        )
+        for i in range(count)
+    ]
+
+
+def seed_notifications(user, count):
+    """`count` unread system notifications for `user`, oldest first"""
+    from notifications.models import Notification
+
+    return [
+        Notification.objects.create(
+            user=user,
+            notification_type='system',
+            title=f'Notification {i}',
+            message='Seeded notification',
+        )
+        for i in range(count)
+    ]
+
+
+@override_settings(CHANNEL_LAYERS=TEST_CHANNEL_LAYERS, CACHES=TEST_CACHES)
+class IsolatedTestCase(TestCase):
+    """
+    A TestCase on the in-memory channel layer and a local-memory cache
+    that starts empty for every test. Suites seed only what they use.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+
+class QueryBudgetTestCase(IsolatedTestCase):
+    """
+    Seeds a realistic account and checks views against settings.QUERY_BUDGETS.
+
+    The dataset is big enough that any per-row query in a view or template
+    pushes the count over budget.
+    """
+    password = 'budget-pass-123'
+
+    @classmethod
+    def setUpTestData(cls):
+        from tasks.models import Category
+
+        cls.user = User.objects.create_user('budget', 'budget@example.com', cls.password)
+        Category.objects.create(name='Global')
+        cls.categories = [
+            Category.objects.create(user=cls.user, name=f'Category {i}') for i in range(5)
+        ]
+        cls.tasks = seed_tasks(cls.user, 30, cls.categories)
+        cls.notifications = seed_notifications(cls.user, 10)
+
+    def setUp(self):
+        from notifications.navbar import get_navbar_snapshot
+
+        super().setUp()
+        # Budgets describe the steady state, where every page reads the
+        # navbar from its cached snapshot; building one has its own test
+        get_navbar_snapshot(self.user)
+        self.client.login(username=self.user.username, password=self.password)
+
+    def assertWithinBudget(self, url_name, kwargs=None, method='get', data=None, **extra):
+        budget = get_budget(url_name)
+        self.assertIsNotNone(budget, f'No query budget declared for "{url_name}"')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(reverse(url_name, kwargs=kwargs), data or {}, **extra)
+
+        queries = '\n'.join(query['sql'] for query in ctx.captured_queries)
+        self.assertLessEqual(
+            len(ctx), budget,
+            f'"{url_name}" ran {len(ctx)} queries, budget is {budget}:\n{queries}'
+        )
+        return response
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib and Django's SMTP backend"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply('220 localhost test SMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO', 'NOOP'):
+                self.reply('250 localhost')
+            elif verb in ('MAIL', 'RSET'):
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in server.reject:
+                    self.reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for data_line in iter(self.rfile.readline, b''):
+                    if data_line == b'.\r\n':
+                        break
+                    data.append(data_line.decode())
+                server.messages.append((recipients, ''.join(data)))
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    A local SMTP stand-in for email tests. Counts connections, records
+    (recipients, data) per message and refuses addresses in `reject`.
+
+        with LocalSMTPServer() as smtp, self.settings(**smtp.email_settings()):
+            ...
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.connections = 0
+        self.messages = []
+        self.reject = set()
+
+    def email_settings(self):
+        return {
+            'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+            'EMAIL_HOST': '127.0.0.1',
+            'EMAIL_PORT': self.server_address[1],
+            'EMAIL_HOST_USER': '',
+            'EMAIL_USE_TLS': False,
+            'EMAIL_USE_SSL': False,
+        }
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Category, Task, TaskAttachment
+from .models import ArchivedTask, Category, Task, TaskAttachment, TaskStats
+from .search import search_tasks
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'color', 'user', 'created_at')
@@ -12,11 +13,36 @@ class TaskAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description')
     date_hierarchy = 'created_at'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_tasks(queryset, search_term), False
+
+class ArchivedTaskAdmin(admin.ModelAdmin):
+    list_display = ('title', 'user', 'status', 'priority', 'completed_at', 'archived_at')
+    list_filter = ('status', 'priority')
+    search_fields = ('title', 'description')
+    date_hierarchy = 'archived_at'
+    actions = ['restore']
+
+    @admin.action(description='Restore selected tasks')
+    def restore(self, request, queryset):
+        for archived in queryset:
+            archived.restore()
+        self.message_user(request, f'Restored {len(queryset)} tasks')
+
 class TaskAttachmentAdmin(admin.ModelAdmin):
     list_display = ('filename', 'task', 'file_type', 'file_size', 'uploaded_at')
     list_filter = ('file_type',)
     search_fields = ('filename', 'task__title')
 
+class TaskStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'total', 'pending', 'in_progress', 'completed', 'overdue', 'categories')
+    search_fields = ('user__username',)
+    readonly_fields = [field.name for field in TaskStats._meta.fields]
+
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Task, TaskAdmin)
+admin.site.register(ArchivedTask, ArchivedTaskAdmin)
 admin.site.register(TaskAttachment, TaskAttachmentAdmin)
+admin.site.register(TaskStats, TaskStatsAdmin)
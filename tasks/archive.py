@@ -0,0 +1,73 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from task_manager.batches import BatchRunner
+
+from .models import ArchivedTask, Task, TaskAttachment, batched_task_changes
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_PAUSE = 0.1  # seconds between batches
+CLOSED_STATUSES = ['completed', 'cancelled']
+
+
+def archive_cutoff(now=None):
+    return (now or timezone.now()) - timedelta(days=settings.TASK_ARCHIVE_DAYS)
+
+
+def archivable_tasks(now=None):
+    """Closed tasks nobody has touched for TASK_ARCHIVE_DAYS"""
+    return Task.objects.filter(status__in=CLOSED_STATUSES, updated_at__lt=archive_cutoff(now))
+
+
+def search_archived(queryset, query):
+    """
+    Plain substring search; the full-text index only covers the live
+    table, and archive searches are rare enough not to need one.
+    """
+    return queryset.filter(Q(title__icontains=query) | Q(description__icontains=query))
+
+
+def _attachments(task_ids):
+    """{task_id: [attachment field values, ...]} in the shape ArchivedTask stores"""
+    file_field = TaskAttachment._meta.get_field('file')
+    by_task = {}
+    rows = TaskAttachment.objects.filter(task_id__in=task_ids).order_by('pk').values(
+        'task_id', *ArchivedTask.ATTACHMENT_FIELDS
+    )
+    for row in rows:
+        row['file'] = file_field.get_prep_value(row['file'])
+        by_task.setdefault(row.pop('task_id'), []).append(row)
+    return by_task
+
+
+def archive_tasks(batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE, max_seconds=None, now=None):
+    """
+    Move closed tasks older than TASK_ARCHIVE_DAYS into ArchivedTask.
+
+    Each batch is copied and deleted in one transaction, in primary-key
+    order, so a task is always in exactly one of the two tables. Stats
+    and search updates for the removed rows are flushed once per batch.
+    Returns a report dict like the notification purge.
+    """
+    runner = BatchRunner(batch_size, pause=pause, max_seconds=max_seconds)
+
+    def archive_batch(rows):
+        task_ids = [row['id'] for row in rows]
+        attachments = _attachments(task_ids)
+        ArchivedTask.objects.bulk_create([
+            ArchivedTask(attachments=attachments.get(row['id'], []), **row) for row in rows
+        ], ignore_conflicts=True)
+        # Attachment rows cascade; their files stay, the archive points at them
+        Task.objects.filter(pk__in=task_ids).delete()
+
+    runner.run(archivable_tasks(now).values(*ArchivedTask.TASK_FIELDS), archive_batch,
+               atomic=batched_task_changes, lock=True)
+    report = runner.report(archived=runner.rows)
+    logger.info('Task archive: %s', report)
+    return report
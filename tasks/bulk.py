@@ -0,0 +1,92 @@
+from django.utils import timezone
+
+from .models import Task, Category, TaskStats, batched_task_changes
+
+BULK_ACTIONS = ['complete', 'delete', 'priority', 'category']
+BULK_ACTION_LIMIT = 1000
+
+STATE_FIELDS = ('user_id', 'status', 'priority', 'due_date')
+
+
+class BulkActionError(ValueError):
+    pass
+
+
+def _states(tasks):
+    """(old_state, pk) pairs for the tasks about to change"""
+    return [
+        (row[1:], row[0])
+        for row in tasks.values_list('pk', *STATE_FIELDS)
+    ]
+
+
+def _update(tasks, **fields):
+    """
+    Apply a set-based UPDATE and record the stats delta in one go.
+
+    queryset.update() skips Task.save, so the TaskStats bookkeeping that
+    save() normally does is replayed from the captured before/after states.
+    """
+    states = _states(tasks)
+    if not states:
+        return 0
+    fields['updated_at'] = timezone.now()
+    Task.objects.filter(pk__in=[pk for _, pk in states]).update(**fields)
+
+    changes = []
+    for old, _ in states:
+        new = list(old)
+        for index, name in enumerate(STATE_FIELDS):
+            if name in fields:
+                new[index] = fields[name]
+        changes.append((old, tuple(new)))
+    TaskStats.apply_changes(changes)
+    return len(states)
+
+
+def bulk_update_tasks(user, task_ids, action, value=None):
+    """
+    Complete, delete, re-prioritize or re-categorize many of a user's tasks
+    with a fixed number of queries. Returns how many tasks changed.
+    """
+    if action not in BULK_ACTIONS:
+        raise BulkActionError(f'Unknown bulk action "{action}"')
+
+    try:
+        task_ids = {int(pk) for pk in task_ids}
+    except (TypeError, ValueError):
+        raise BulkActionError('Invalid task selection')
+    if not task_ids:
+        raise BulkActionError('No tasks selected')
+    if len(task_ids) > BULK_ACTION_LIMIT:
+        raise BulkActionError(f'You can change at most {BULK_ACTION_LIMIT} tasks at once')
+
+    tasks = Task.objects.filter(user=user, pk__in=task_ids)
+
+    with batched_task_changes():
+        if action == 'complete':
+            # Same completed_at semantics as Task.save
+            return _update(
+                tasks.exclude(status='completed'),
+                status='completed',
+                completed_at=timezone.now(),
+            )
+
+        if action == 'priority':
+            if value not in dict(Task.PRIORITY_CHOICES):
+                raise BulkActionError('Please choose a valid priority')
+            return _update(tasks.exclude(priority=value), priority=value)
+
+        if action == 'category':
+            if value:
+                category = next(
+                    (c for c in Category.cached_for(user) if str(c.pk) == str(value)), None
+                )
+                if category is None:
+                    raise BulkActionError('Please choose a valid category')
+                return _update(tasks.exclude(category=category), category=category)
+            return _update(tasks.exclude(category__isnull=True), category=None)
+
+        # delete: signals still fire per task, but their stats and search
+        # work is collected by batched_task_changes and flushed once.
+        return tasks.delete()[1].get(Task._meta.label, 0)
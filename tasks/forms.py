@@ -1,8 +1,45 @@
 from django import forms
-from django.db import models
 from django.utils import timezone
 from .models import Task, Category, TaskAttachment
 
+class CachedModelChoiceIterator(forms.models.ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in self.field.objects:
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.objects) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.objects)
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField that renders and validates against a preloaded list
+    of objects instead of querying its queryset.
+    """
+    iterator = CachedModelChoiceIterator
+
+    def __init__(self, *args, **kwargs):
+        self.objects = []
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        key = self.to_field_name or 'pk'
+        for obj in self.objects:
+            if str(getattr(obj, key)) == str(value):
+                return obj
+        raise forms.ValidationError(
+            self.error_messages['invalid_choice'],
+            code='invalid_choice',
+            params={'value': value},
+        )
+
 class TaskForm(forms.ModelForm):
     due_date = forms.DateTimeField(
         required=False,
@@ -19,6 +56,7 @@ class TaskForm(forms.ModelForm):
     class Meta:
         model = Task
         fields = ['title', 'description', 'status', 'priority', 'category', 'due_date']
+        field_classes = {'category': CachedModelChoiceField}
         widgets = {
             'title': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -49,17 +87,8 @@ class TaskForm(forms.ModelForm):
         user = kwargs.pop('user', None)
         super(TaskForm, self).__init__(*args, **kwargs)
         
-        # Filter categories by user (if user is provided)
-        if user:
-            # Get both user-specific categories and global categories (user=None)
-            self.fields['category'].queryset = Category.objects.filter(
-                models.Q(user=user) | models.Q(user__isnull=True)
-            ).distinct().order_by('name')
-        else:
-            # Only show global categories
-            self.fields['category'].queryset = Category.objects.filter(
-                user__isnull=True
-            ).order_by('name')
+        # User-specific categories plus global ones (user=None), from cache
+        self.fields['category'].objects = Category.cached_for(user)
         
         # Set initial due date in correct format
         if self.instance and self.instance.due_date:
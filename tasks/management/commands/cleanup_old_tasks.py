@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.retention import CLEANUP_BATCH_SIZE, CLEANUP_MAX_RATE, cleanup_expired_tasks, retention_rules
+
+
+class Command(BaseCommand):
+    help = 'Delete tasks past their TASK_RETENTION_DAYS rule in throttled batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be deleted')
+        parser.add_argument('--batch-size', type=int, default=CLEANUP_BATCH_SIZE)
+        parser.add_argument('--max-rate', type=int, default=CLEANUP_MAX_RATE,
+                            help='Tasks deleted per second, 0 for no limit')
+        parser.add_argument('--max-seconds', type=float,
+                            help='Stop after this long; the next run continues')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if not retention_rules():
+            raise CommandError('TASK_RETENTION_DAYS has no rules, nothing would be deleted')
+
+        report = cleanup_expired_tasks(
+            dry_run=options['dry_run'],
+            batch_size=options['batch_size'],
+            max_rate=options['max_rate'],
+            max_seconds=options['max_seconds'],
+        )
+        by_status = ', '.join(f'{status}: {count}' for status, count in report['by_status'].items())
+        if report['dry_run']:
+            self.stdout.write(
+                f"Would delete {report['deleted']} tasks ({by_status}) with "
+                f"{report['attachments']} attachments ({report['attachment_bytes']} bytes)"
+            )
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {report['deleted']} tasks ({by_status}) and queued {report['attachments']} "
+            f"attachment blobs in {report['elapsed']}s, {report['remaining']} remaining"
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from tasks.search import rebuild_index, search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for tasks'
+
+    def handle(self, *args, **options):
+        backend = search_backend()
+        if backend != 'sqlite':
+            self.stdout.write(f'Nothing to rebuild on {backend or "this database"}; '
+                              'the index is maintained by the database.')
+            return
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} tasks'))
@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.models import TaskStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user task statistics rows, or verify them against the tasks table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only process this username')
+        parser.add_argument('--verify', action='store_true',
+                            help='Compare stored counters with a fresh count instead of rebuilding')
+
+    def handle(self, *args, **options):
+        users = User.objects.all().order_by('pk')
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f'User "{options["user"]}" does not exist')
+
+        processed = mismatched = 0
+        for user in users.iterator():
+            processed += 1
+            if not options['verify']:
+                TaskStats.rebuild(user)
+                continue
+
+            stored = TaskStats.objects.filter(user=user).first()
+            if stored is None:
+                mismatched += 1
+                self.stdout.write(self.style.WARNING(f'{user.username}: no stats row'))
+                continue
+            # Overdue is only exact as of the last check, so compare against that
+            expected = TaskStats.compute(user, now=stored.overdue_checked_at)
+            diffs = [
+                f'{field}={getattr(stored, field)} (expected {expected[field]})'
+                for field in TaskStats.COUNTER_FIELDS
+                if getattr(stored, field) != expected[field]
+            ]
+            if diffs:
+                mismatched += 1
+                self.stdout.write(self.style.WARNING(f'{user.username}: ' + ', '.join(diffs)))
+
+        if options['verify']:
+            if mismatched:
+                raise CommandError(f'{mismatched} of {processed} users have stale stats; '
+                                   'run rebuild_task_stats to fix them')
+            self.stdout.write(self.style.SUCCESS(f'Verified stats for {processed} users'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {processed} users'))
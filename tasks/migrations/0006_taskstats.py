@@ -0,0 +1,39 @@
+# Generated by Django 5.2.9 on 2026-10-18 04:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('tasks', '0005_task_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='task_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total', models.IntegerField(default=0)),
+                ('pending', models.IntegerField(default=0)),
+                ('in_progress', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('low_priority', models.IntegerField(default=0)),
+                ('medium_priority', models.IntegerField(default=0)),
+                ('high_priority', models.IntegerField(default=0)),
+                ('urgent_priority', models.IntegerField(default=0)),
+                ('overdue', models.IntegerField(default=0)),
+                ('overdue_checked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('next_due_at', models.DateTimeField(blank=True, null=True)),
+                ('categories', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Task stats',
+            },
+        ),
+    ]
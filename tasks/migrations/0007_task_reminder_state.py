@@ -0,0 +1,24 @@
+# Generated by Django 5.2.9 on 2026-10-18 04:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0006_taskstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='reminder_state',
+            field=models.CharField(blank=True, choices=[('', 'Not notified'), ('due', 'Due soon notified'), ('overdue', 'Overdue notified')], default='', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'in_progress'])), fields=['reminder_state', 'due_date'], name='tasks_task_reminder_idx'),
+        ),
+    ]
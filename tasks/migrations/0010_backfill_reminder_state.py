@@ -0,0 +1,24 @@
+# Generated by Django 5.2.9 on 2026-10-18 09:12
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def mark_overdue_as_notified(apps, schema_editor):
+    # Tasks that were already overdue before reminders existed are not
+    # news; without this the first sweep would remind (and email) them all
+    Task = apps.get_model('tasks', 'Task')
+    Task.objects.filter(
+        status__in=['pending', 'in_progress'], reminder_state='', due_date__lt=timezone.now()
+    ).update(reminder_state='overdue')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0009_archived_task'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_overdue_as_notified, migrations.RunPython.noop),
+    ]
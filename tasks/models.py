@@ -1,9 +1,42 @@
-from django.db import models
+import threading
+from contextlib import contextmanager
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Min, Q, Value, When
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from cloudinary.models import CloudinaryField
+from .search import index_task, unindex_tasks
+
+_task_batch = threading.local()
+
+
+@contextmanager
+def batched_task_changes():
+    """
+    Defer the stats and search bookkeeping that task saves and deletes
+    trigger, and flush it with a handful of set-based queries on exit.
+    Used by bulk operations so their cost does not grow per task.
+    """
+    if getattr(_task_batch, 'active', False):
+        yield
+        return
+    
+    _task_batch.active = True
+    _task_batch.changes = []
+    _task_batch.unindexed = []
+    try:
+        with transaction.atomic():
+            yield
+            TaskStats.apply_changes(_task_batch.changes)
+            unindex_tasks(_task_batch.unindexed)
+    finally:
+        _task_batch.active = False
+        _task_batch.changes = []
+        _task_batch.unindexed = []
 
 class Category(models.Model):
     """Task categories"""
@@ -23,6 +56,35 @@ class Category(models.Model):
         if not self.color.startswith('#'):
             self.color = '#' + self.color
         super().save(*args, **kwargs)
+    
+    CACHE_TIMEOUT = 60 * 60
+    
+    @staticmethod
+    def cache_key(user_id=None):
+        if user_id is None:
+            return 'tasks:categories:global'
+        return f'tasks:categories:user:{user_id}'
+    
+    @classmethod
+    def cached_for(cls, user=None):
+        """
+        The user's own categories plus the global ones, ordered by name.
+
+        Both lists are cached separately (the global one is shared by every
+        user) and dropped whenever a category is saved or deleted.
+        """
+        querysets = {cls.cache_key(): cls.objects.filter(user__isnull=True)}
+        if user is not None and user.is_authenticated:
+            querysets[cls.cache_key(user.pk)] = cls.objects.filter(user=user)
+        
+        cached = cache.get_many(list(querysets))
+        for key, queryset in querysets.items():
+            if key not in cached:
+                cached[key] = list(queryset.order_by('name'))
+                cache.set(key, cached[key], cls.CACHE_TIMEOUT)
+        
+        categories = [category for key in querysets for category in cached[key]]
+        return sorted(categories, key=lambda category: category.name)
 
 class Task(models.Model):
     STATUS_CHOICES = [
@@ -53,12 +115,29 @@ class Task(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
+    # Last due/overdue reminder sent for the current due_date
+    REMINDER_CHOICES = [
+        ('', 'Not notified'),
+        ('due', 'Due soon notified'),
+        ('overdue', 'Overdue notified'),
+    ]
+    reminder_state = models.CharField(max_length=10, choices=REMINDER_CHOICES, blank=True, default='')
+    
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user', 'status']),
             models.Index(fields=['user', 'due_date']),
             models.Index(fields=['user', 'priority']),
+            models.Index(fields=['user', 'created_at', 'id']),
+            # Open tasks still waiting for a reminder, by due date
+            models.Index(
+                fields=['reminder_state', 'due_date'],
+                condition=models.Q(status__in=['pending', 'in_progress']),
+                name='tasks_task_reminder_idx',
+            ),
+            # Cold tasks per status, for the retention cleanup
+            models.Index(fields=['status', 'updated_at'], name='tasks_task_retention_idx'),
         ]
     
     def __str__(self):
@@ -80,9 +159,22 @@ class Task(models.Model):
             return max(0, delta.days)
         return None
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stats_state = instance.stats_state()
+        return instance
+    
+    def stats_state(self):
+        """The fields TaskStats counts, as they currently stand on this instance"""
+        data = self.__dict__
+        if not all(name in data for name in ('user_id', 'status', 'priority', 'due_date')):
+            return None
+        return (data['user_id'], data['status'], data['priority'], data['due_date'])
+    
     def save(self, *args, **kwargs):
-        # Track if this is a new task
-        is_new = self.pk is None
+        # Track if this is a new task (restores insert with their old id)
+        is_new = self.pk is None or bool(kwargs.get('force_insert'))
         
         # Set completed_at if status changed to completed
         if self.status == 'completed' and not self.completed_at:
@@ -90,7 +182,294 @@ class Task(models.Model):
         elif self.status != 'completed':
             self.completed_at = None
         
-        super().save(*args, **kwargs)
+        if is_new:
+            previous_state = None
+        else:
+            previous_state = getattr(self, '_stats_state', None)
+            if previous_state is None:
+                previous_state = Task.objects.filter(pk=self.pk).values_list(
+                    'user_id', 'status', 'priority', 'due_date'
+                ).first()
+        
+        # A new due date deserves fresh reminders
+        if previous_state and previous_state[3] != self.due_date:
+            self.reminder_state = ''
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'due_date' in update_fields:
+                kwargs['update_fields'] = set(update_fields) | {'reminder_state'}
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._stats_state = self.stats_state()
+            TaskStats.record_change(previous_state, self._stats_state)
+
+class TaskStats(models.Model):
+    """
+    Denormalized per-user task counters.
+
+    Task.save and task deletion adjust the row in the same transaction, so
+    readers get every dashboard number from a single primary-key lookup.
+    The overdue count is exact as of overdue_checked_at; next_due_at marks
+    the earliest moment it can go stale and triggers a refresh on read.
+    """
+    STATUS_FIELDS = {
+        'pending': 'pending',
+        'in_progress': 'in_progress',
+        'completed': 'completed',
+        'cancelled': 'cancelled',
+    }
+    PRIORITY_FIELDS = {
+        'low': 'low_priority',
+        'medium': 'medium_priority',
+        'high': 'high_priority',
+        'urgent': 'urgent_priority',
+    }
+    OPEN_STATUSES = ['pending', 'in_progress']
+    COUNTER_FIELDS = [
+        'total', 'pending', 'in_progress', 'completed', 'cancelled',
+        'low_priority', 'medium_priority', 'high_priority', 'urgent_priority',
+        'overdue', 'categories',
+    ]
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='task_stats')
+    total = models.IntegerField(default=0)
+    
+    pending = models.IntegerField(default=0)
+    in_progress = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    
+    low_priority = models.IntegerField(default=0)
+    medium_priority = models.IntegerField(default=0)
+    high_priority = models.IntegerField(default=0)
+    urgent_priority = models.IntegerField(default=0)
+    
+    overdue = models.IntegerField(default=0)
+    overdue_checked_at = models.DateTimeField(default=timezone.now)
+    next_due_at = models.DateTimeField(null=True, blank=True)
+    
+    categories = models.IntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = "Task stats"
+    
+    def __str__(self):
+        return f"Task stats for user {self.user_id}"
+    
+    @classmethod
+    def for_user(cls, user):
+        """Return the user's stats row, building or refreshing it if needed"""
+        try:
+            stats = user.task_stats
+        except cls.DoesNotExist:
+            stats = cls.rebuild(user)
+            user.task_stats = stats
+            return stats
+        
+        if stats.next_due_at and stats.next_due_at <= timezone.now():
+            stats.refresh_overdue()
+        return stats
+    
+    @classmethod
+    def compute(cls, user, now=None):
+        """Count everything from scratch with one aggregate over the user's tasks"""
+        now = now or timezone.now()
+        open_due = Q(status__in=cls.OPEN_STATUSES, due_date__isnull=False)
+        aggregates = {'total': Count('id')}
+        for status, field in cls.STATUS_FIELDS.items():
+            aggregates[field] = Count('id', filter=Q(status=status))
+        for priority, field in cls.PRIORITY_FIELDS.items():
+            aggregates[field] = Count('id', filter=Q(priority=priority))
+        aggregates['overdue'] = Count('id', filter=open_due & Q(due_date__lt=now))
+        aggregates['next_due_at'] = Min('due_date', filter=open_due & Q(due_date__gte=now))
+        
+        values = Task.objects.filter(user=user).aggregate(**aggregates)
+        values['categories'] = Category.objects.filter(user=user).count()
+        values['overdue_checked_at'] = now
+        return values
+    
+    @classmethod
+    def rebuild(cls, user):
+        with transaction.atomic():
+            stats, _ = cls.objects.update_or_create(user=user, defaults=cls.compute(user))
+        return stats
+    
+    def refresh_overdue(self):
+        """Recount overdue tasks now that a due date has passed"""
+        now = timezone.now()
+        values = Task.objects.filter(
+            user_id=self.user_id,
+            status__in=self.OPEN_STATUSES,
+            due_date__isnull=False,
+        ).aggregate(
+            overdue=Count('id', filter=Q(due_date__lt=now)),
+            next_due_at=Min('due_date', filter=Q(due_date__gte=now)),
+        )
+        self.overdue = values['overdue']
+        self.next_due_at = values['next_due_at']
+        self.overdue_checked_at = now
+        self.save(update_fields=['overdue', 'next_due_at', 'overdue_checked_at'])
+    
+    @classmethod
+    def refresh_overdue_many(cls, user_ids, now=None):
+        """
+        refresh_overdue for several users at once: one grouped count and
+        one bulk UPDATE. Returns {user_id: overdue}.
+        """
+        now = now or timezone.now()
+        counts = {
+            row['user_id']: row
+            for row in Task.objects.filter(
+                user_id__in=user_ids,
+                status__in=cls.OPEN_STATUSES,
+                due_date__isnull=False,
+            ).order_by().values('user_id').annotate(
+                overdue=Count('id', filter=Q(due_date__lt=now)),
+                next_due_at=Min('due_date', filter=Q(due_date__gte=now)),
+            )
+        }
+        stats = [
+            cls(
+                user_id=user_id,
+                overdue=counts.get(user_id, {}).get('overdue', 0),
+                next_due_at=counts.get(user_id, {}).get('next_due_at'),
+                overdue_checked_at=now,
+            )
+            for user_id in user_ids
+        ]
+        cls.objects.bulk_update(stats, ['overdue', 'next_due_at', 'overdue_checked_at'])
+        return {row.user_id: row.overdue for row in stats}
+    
+    @classmethod
+    def _open_due_date(cls, state):
+        if state is None:
+            return None
+        _, status, _, due_date = state
+        if status in cls.OPEN_STATUSES:
+            return due_date
+        return None
+    
+    @classmethod
+    def apply_changes(cls, changes):
+        """
+        Apply many (old, new) task states at once: one locked read for all
+        affected users and one write per user.
+        """
+        by_user = {}
+        for old, new in changes:
+            if old == new:
+                continue
+            for state, sign in ((old, -1), (new, 1)):
+                if state is not None:
+                    by_user.setdefault(state[0], []).append((state, sign))
+        if not by_user:
+            return
+        
+        with transaction.atomic():
+            for stats in cls.objects.select_for_update().filter(user_id__in=by_user):
+                for (_, status, priority, due_date), sign in by_user[stats.user_id]:
+                    stats.total += sign
+                    for field in (cls.STATUS_FIELDS.get(status), cls.PRIORITY_FIELDS.get(priority)):
+                        if field:
+                            setattr(stats, field, getattr(stats, field) + sign)
+                    if status in cls.OPEN_STATUSES and due_date:
+                        if due_date < stats.overdue_checked_at:
+                            stats.overdue += sign
+                        elif sign > 0 and (stats.next_due_at is None or due_date < stats.next_due_at):
+                            stats.next_due_at = due_date
+                stats.save()
+    
+    @classmethod
+    def record_change(cls, old, new):
+        """
+        Apply the difference between two task states as one UPDATE.
+
+        A state is (user_id, status, priority, due_date); None stands for
+        "task does not exist". Changes that touch no counter cost no query.
+        """
+        if old == new:
+            return
+        if getattr(_task_batch, 'active', False):
+            _task_batch.changes.append((old, new))
+            return
+        if old and new and old[0] != new[0]:
+            cls.record_change(old, None)
+            cls.record_change(None, new)
+            return
+        
+        deltas = {}
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            _, status, priority, _ = state
+            for field in ('total', cls.STATUS_FIELDS.get(status), cls.PRIORITY_FIELDS.get(priority)):
+                if field:
+                    deltas[field] = deltas.get(field, 0) + sign
+        updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        
+        old_due = cls._open_due_date(old)
+        new_due = cls._open_due_date(new)
+        if old_due != new_due:
+            # A task only counts as overdue if it was already past due when
+            # the overdue count was last taken.
+            overdue = F('overdue')
+            if old_due:
+                overdue = overdue - Case(
+                    When(overdue_checked_at__gt=old_due, then=Value(1)), default=Value(0)
+                )
+            if new_due:
+                overdue = overdue + Case(
+                    When(overdue_checked_at__gt=new_due, then=Value(1)), default=Value(0)
+                )
+                updates['next_due_at'] = Case(
+                    When(
+                        Q(overdue_checked_at__lte=new_due) &
+                        (Q(next_due_at__isnull=True) | Q(next_due_at__gt=new_due)),
+                        then=Value(new_due),
+                    ),
+                    default=F('next_due_at'),
+                )
+            updates['overdue'] = overdue
+        
+        if updates:
+            cls.objects.filter(user_id=(new or old)[0]).update(**updates)
+
+@receiver(post_save, sender=Task)
+def index_task_for_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'title', 'description'} & set(update_fields):
+        index_task(instance)
+
+@receiver(post_delete, sender=Task)
+def unindex_task_for_search(sender, instance, **kwargs):
+    if getattr(_task_batch, 'active', False):
+        _task_batch.unindexed.append(instance.pk)
+    else:
+        unindex_tasks([instance.pk])
+
+@receiver(post_save, sender=User)
+def create_user_task_stats(sender, instance, created, **kwargs):
+    if created:
+        TaskStats.objects.get_or_create(user=instance)
+
+@receiver(post_delete, sender=Task)
+def update_stats_on_task_delete(sender, instance, **kwargs):
+    state = getattr(instance, '_stats_state', None) or instance.stats_state()
+    TaskStats.record_change(state, None)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    cache.delete(Category.cache_key(instance.user_id))
+
+@receiver(post_save, sender=Category)
+def update_stats_on_category_create(sender, instance, created, **kwargs):
+    if created and instance.user_id:
+        TaskStats.objects.filter(user_id=instance.user_id).update(categories=F('categories') + 1)
+
+@receiver(post_delete, sender=Category)
+def update_stats_on_category_delete(sender, instance, **kwargs):
+    if instance.user_id:
+        TaskStats.objects.filter(user_id=instance.user_id).update(categories=F('categories') - 1)
 
 class TaskAttachment(models.Model):
     task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='attachments')
@@ -119,4 +498,63 @@ class TaskAttachment(models.Model):
                 self.file_type = 'document'
             else:
                 self.file_type = 'other'
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+class ArchivedTask(models.Model):
+    """
+    Cold copy of a closed task moved out of tasks_task by the archive job.
+    Keeps the original id, so restoring puts the task back where it was,
+    and its attachments as a list of TaskAttachment field values.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_tasks')
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=Task.STATUS_CHOICES)
+    priority = models.CharField(max_length=20, choices=Task.PRIORITY_CHOICES)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='archived_tasks')
+    due_date = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    attachments = models.JSONField(default=list, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    # Copied between Task and ArchivedTask as they are
+    TASK_FIELDS = (
+        'id', 'user_id', 'title', 'description', 'status', 'priority', 'category_id',
+        'due_date', 'created_at', 'updated_at', 'completed_at',
+    )
+    ATTACHMENT_FIELDS = ('file', 'filename', 'file_type', 'file_size')
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id']),
+            # Same scan as the live table's retention cleanup
+            models.Index(fields=['status', 'updated_at'], name='tasks_archived_retention_idx'),
+        ]
+    
+    def __str__(self):
+        return self.title
+    
+    @property
+    def is_completed(self):
+        return self.status == 'completed'
+    
+    def restore(self):
+        """Move the task back into the live table, returns the new Task"""
+        with transaction.atomic():
+            task = Task(**{field: getattr(self, field) for field in self.TASK_FIELDS})
+            task.save(force_insert=True)
+            # auto_now_add stamped the insert; put the original date back. The
+            # restore itself counts as a touch, so updated_at stays now and
+            # the archive and retention jobs do not take the task straight back
+            task.created_at = self.created_at
+            Task.objects.filter(pk=task.pk).update(created_at=task.created_at)
+            TaskAttachment.objects.bulk_create([
+                TaskAttachment(task=task, **attachment) for attachment in self.attachments
+            ])
+            self.delete()
+        return task
@@ -0,0 +1,105 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(task, direction):
+    """Build an opaque token pointing at a task's (created_at, id) position"""
+    payload = json.dumps({
+        'c': task.created_at.isoformat(),
+        'i': task.pk,
+        'd': direction,
+    }, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Turn a token back into (created_at, id, direction)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = datetime.fromisoformat(payload['c'])
+        pk = int(payload['i'])
+        direction = payload['d']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor(token)
+    return created_at, pk, direction
+
+
+class CursorPage:
+    """One page of a keyset-paginated queryset, newest first"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def cursor_paginate(queryset, per_page, cursor=None):
+    """
+    Paginate a queryset on (created_at, id) without COUNT or OFFSET.
+
+    Each page is a single indexed range scan, so the cost stays the same
+    no matter how deep the user pages.
+    """
+    direction = 'next'
+    if cursor:
+        created_at, pk, direction = decode_cursor(cursor)
+        if direction == 'next':
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) |
+                Q(created_at=created_at, id__lt=pk)
+            )
+        else:
+            queryset = queryset.filter(
+                Q(created_at__gt=created_at) |
+                Q(created_at=created_at, id__gt=pk)
+            )
+
+    if direction == 'next':
+        queryset = queryset.order_by('-created_at', '-id')
+    else:
+        queryset = queryset.order_by('created_at', 'id')
+
+    # Fetch one extra row to find out whether there is another page
+    rows = list(queryset[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if direction == 'prev':
+        rows.reverse()
+        has_next, has_previous = bool(rows), has_more
+    else:
+        has_next, has_previous = has_more, cursor is not None and bool(rows)
+
+    next_cursor = encode_cursor(rows[-1], 'next') if has_next else None
+    previous_cursor = encode_cursor(rows[0], 'prev') if has_previous else None
+    return CursorPage(rows, next_cursor, previous_cursor)
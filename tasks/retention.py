@@ -0,0 +1,131 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from task_manager.batches import BatchRunner
+
+from .models import ArchivedTask, Task, TaskAttachment, batched_task_changes
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_BATCH_SIZE = 500
+CLEANUP_MAX_RATE = 1000  # tasks deleted per second, None for no limit
+BLOB_DELETE_CHUNK = 100  # Cloudinary's limit for one delete_resources call
+
+
+def retention_rules():
+    """{status: days}; statuses without a rule are never cleaned up"""
+    return getattr(settings, 'TASK_RETENTION_DAYS', {})
+
+
+def expired_tasks(now=None, model=Task):
+    """
+    Tasks (or archived tasks) past the retention of their status. Age is
+    measured from updated_at, so anything touched recently stays however
+    old it is.
+    """
+    now = now or timezone.now()
+    condition = Q(pk__in=[])
+    for status, days in retention_rules().items():
+        condition |= Q(status=status, updated_at__lt=now - timedelta(days=days))
+    return model.objects.filter(condition)
+
+
+def _public_id(file):
+    return TaskAttachment._meta.get_field('file').to_python(file).public_id
+
+
+def _delete_tasks(rows):
+    task_ids = [row[0] for row in rows]
+    files = list(TaskAttachment.objects.filter(task_id__in=task_ids).values_list('file', flat=True))
+    # Attachment rows cascade with the tasks; signals still fire, but the
+    # stats and search work is flushed once for the whole batch.
+    with batched_task_changes():
+        Task.objects.filter(pk__in=task_ids).delete()
+    return [file.public_id for file in files if file]
+
+
+def _delete_archived(rows):
+    ArchivedTask.objects.filter(pk__in=[row[0] for row in rows]).delete()
+    return [_public_id(attachment['file']) for row in rows for attachment in row[2] if attachment['file']]
+
+
+# (model, columns fetched per batch, deletes a batch and returns its blob ids)
+TABLES = (
+    (Task, ('pk', 'status'), _delete_tasks),
+    (ArchivedTask, ('pk', 'status', 'attachments'), _delete_archived),
+)
+
+
+def _queue_blob_deletes(public_ids):
+    # views imports this module, so import the Celery task lazily
+    from .views import delete_attachment_blobs
+
+    for start in range(0, len(public_ids), BLOB_DELETE_CHUNK):
+        delete_attachment_blobs.delay(public_ids[start:start + BLOB_DELETE_CHUNK])
+
+
+def _dry_run(now, runner):
+    counts = {status: Count('pk', filter=Q(status=status)) for status in retention_rules()}
+    live = expired_tasks(now).aggregate(**counts)
+    archived = expired_tasks(now, ArchivedTask).aggregate(**counts)
+    by_status = {status: live[status] + archived[status] for status in counts}
+
+    attachments = TaskAttachment.objects.filter(task__in=expired_tasks(now)).aggregate(
+        count=Count('pk'), size=Sum('file_size')
+    )
+    count, size = attachments['count'], attachments['size'] or 0
+    for stored in expired_tasks(now, ArchivedTask).values_list('attachments', flat=True).iterator():
+        count += len(stored)
+        size += sum(attachment['file_size'] for attachment in stored)
+    return runner.report(
+        dry_run=True,
+        deleted=sum(by_status.values()),
+        from_archive=sum(archived.values()),
+        by_status=by_status,
+        attachments=count,
+        attachment_bytes=size,
+    )
+
+
+def cleanup_expired_tasks(dry_run=False, batch_size=CLEANUP_BATCH_SIZE, max_rate=CLEANUP_MAX_RATE,
+                          max_seconds=None, now=None):
+    """
+    Delete tasks past TASK_RETENTION_DAYS for their status, from the live
+    table first and then from the archive.
+
+    Works in primary-key order, one short transaction per batch, sleeping
+    as needed to stay under `max_rate` tasks per second. Remote attachment
+    blobs are queued for deletion once each batch has committed. Stops
+    early after `max_seconds`; the next run picks up the rest. With
+    `dry_run` nothing is deleted and the report says what would be.
+    """
+    runner = BatchRunner(batch_size, max_rate=max_rate, max_seconds=max_seconds)
+    now = now or timezone.now()
+    if dry_run:
+        report = _dry_run(now, runner)
+        logger.info('Task cleanup dry run: %s', report)
+        return report
+
+    counts = {'from_archive': 0, 'attachments': 0}
+    by_status = dict.fromkeys(retention_rules(), 0)
+    for model, columns, delete_batch in TABLES:
+        def delete(rows, model=model, delete_batch=delete_batch):
+            public_ids = delete_batch(rows)
+            if public_ids:
+                transaction.on_commit(lambda: _queue_blob_deletes(public_ids))
+            counts['attachments'] += len(public_ids)
+            if model is ArchivedTask:
+                counts['from_archive'] += len(rows)
+            for row in rows:
+                by_status[row[1]] += 1
+
+        runner.run(expired_tasks(now, model).values_list(*columns), delete)
+
+    report = runner.report(dry_run=False, deleted=runner.rows, by_status=by_status, **counts)
+    logger.info('Task cleanup: %s', report)
+    return report
@@ -0,0 +1,108 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+# SQLite keeps a FTS5 table keyed on the task id; PostgreSQL keeps a generated
+# tsvector column on tasks_task itself (see migration 0005).
+FTS_TABLE = 'tasks_task_fts'
+PG_CONFIG = 'simple'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_backend():
+    """Return which full-text engine the current database supports"""
+    if connection.vendor in ('sqlite', 'postgresql'):
+        return connection.vendor
+    return None
+
+
+def _tokens(query):
+    return TOKEN_RE.findall(query or '')[:16]
+
+
+def build_match_query(query):
+    """Turn free text into a prefix-matching FTS5 or tsquery expression"""
+    tokens = _tokens(query)
+    if not tokens:
+        return ''
+    if search_backend() == 'postgresql':
+        return ' & '.join(f'{token}:*' for token in tokens)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_tasks(queryset, query):
+    """
+    Filter a Task queryset to full-text matches, best matches first.
+
+    Prefix matching is applied to every word, so "rep" finds "report".
+    Falls back to icontains on databases without a full-text engine.
+    """
+    backend = search_backend()
+    match = build_match_query(query)
+    if not match:
+        return queryset
+
+    if backend == 'sqlite':
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = tasks_task.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'{FTS_TABLE}.rank'},
+            order_by=['search_rank', '-created_at'],
+        )
+
+    if backend == 'postgresql':
+        return queryset.extra(
+            where=['tasks_task.search_vector @@ to_tsquery(%s, %s)'],
+            params=[PG_CONFIG, match],
+            select={'search_rank': 'ts_rank(tasks_task.search_vector, to_tsquery(%s, %s))'},
+            select_params=[PG_CONFIG, match],
+            order_by=['-search_rank', '-created_at'],
+        )
+
+    return queryset.filter(
+        Q(title__icontains=query) |
+        Q(description__icontains=query)
+    )
+
+
+def index_task(task):
+    """Write a task's title/description into the SQLite FTS table"""
+    if search_backend() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [task.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (%s, %s, %s)',
+            [task.pk, task.title, task.description]
+        )
+
+
+def unindex_task(task_id):
+    """Drop a task from the SQLite FTS table"""
+    unindex_tasks([task_id])
+
+
+def unindex_tasks(task_ids):
+    """Drop several tasks from the SQLite FTS table in one statement"""
+    task_ids = list(task_ids)
+    if not task_ids or search_backend() != 'sqlite':
+        return
+    placeholders = ', '.join(['%s'] * len(task_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', task_ids)
+
+
+def rebuild_index():
+    """Repopulate the SQLite FTS table from tasks_task, returns rows indexed"""
+    if search_backend() != 'sqlite':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, description) '
+            'SELECT id, title, description FROM tasks_task'
+        )
+        return cursor.rowcount
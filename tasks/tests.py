@@ -1,3 +1,410 @@
-from django.test import TestCase
+import base64
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.urls import URLPattern, get_resolver, reverse
+from django.utils import timezone
+
+from notifications.email import queue_email
+from notifications.models import QueuedEmail
+from task_manager.celery import app as celery_app
+from task_manager.task_metrics import record_lag
+from task_manager.testing import IsolatedTestCase, QueryBudgetTestCase, seed_tasks
+from .archive import archive_tasks
+from .models import ArchivedTask, Category, Task, TaskAttachment, TaskStats, batched_task_changes
+from .pagination import cursor_paginate, encode_cursor
+from .retention import cleanup_expired_tasks
+from .search import search_tasks
+from .views import cleanup_old_tasks, send_welcome_email
+
+
+class TaskViewQueryBudgetTests(QueryBudgetTestCase):
+    def test_every_named_view_has_a_budget(self):
+        app_views = ('tasks.', 'notifications.', 'accounts.')
+        missing = []
+
+        def walk(patterns):
+            for pattern in patterns:
+                if isinstance(pattern, URLPattern):
+                    if pattern.name and pattern.callback.__module__.startswith(app_views):
+                        if pattern.name not in settings.QUERY_BUDGETS:
+                            missing.append(pattern.name)
+                else:
+                    walk(pattern.url_patterns)
+
+        walk(get_resolver().url_patterns)
+        self.assertEqual(missing, [])
+
+    def test_dashboard(self):
+        self.assertWithinBudget('dashboard')
+
+    def test_task_list(self):
+        self.assertWithinBudget('task_list')
+        self.assertWithinBudget('task_list', data={'per_page': 100})
+        self.assertWithinBudget('task_list', data={'pagination': 'cursor', 'per_page': 100})
+        self.assertWithinBudget('task_list', data={'search': 'task', 'status': 'pending'})
+
+    def test_task_create(self):
+        self.assertWithinBudget('task_create')
+        self.assertWithinBudget('task_create', method='post', data={
+            'title': 'New', 'status': 'pending', 'priority': 'low',
+            'category': self.categories[0].pk,
+        })
+        self.assertEqual(Task.objects.get(title='New').category, self.categories[0])
+
+    def test_task_detail(self):
+        self.assertWithinBudget('task_detail', kwargs={'pk': self.tasks[0].pk})
+
+    def test_task_update(self):
+        task = self.tasks[0]
+        self.assertWithinBudget('task_update', kwargs={'pk': task.pk})
+        self.assertWithinBudget('task_update', kwargs={'pk': task.pk}, method='post', data={
+            'title': 'Renamed', 'status': 'in_progress', 'priority': 'high',
+        })
+
+    def test_task_delete(self):
+        task = self.tasks[0]
+        self.assertWithinBudget('task_delete', kwargs={'pk': task.pk})
+        self.assertWithinBudget('task_delete', kwargs={'pk': task.pk}, method='post')
+        self.assertFalse(Task.objects.filter(pk=task.pk).exists())
+
+    def test_task_complete(self):
+        self.assertWithinBudget('task_complete', kwargs={'pk': self.tasks[0].pk})
+
+    def test_categories(self):
+        category = self.categories[0]
+        self.assertWithinBudget('manage_categories')
+        self.assertWithinBudget('create_category')
+        self.assertWithinBudget('update_category', kwargs={'pk': category.pk})
+        self.assertWithinBudget('delete_category', kwargs={'pk': category.pk})
+
+    def test_delete_unused_category(self):
+        category = Category.objects.create(user=self.user, name='Unused')
+        self.assertWithinBudget('delete_category', kwargs={'pk': category.pk}, method='post')
+
+    def test_bulk_complete(self):
+        ids = [task.pk for task in self.tasks]
+        self.assertWithinBudget('task_bulk_action', method='post', data={
+            'action': 'complete', 'task_ids': ids,
+        })
+        self.assertFalse(Task.objects.filter(pk__in=ids).exclude(status='completed').exists())
+        self.assertFalse(Task.objects.filter(pk__in=ids, completed_at__isnull=True).exists())
+        self.assertEqual(TaskStats.objects.get(user=self.user).completed, len(ids))
+
+    def test_bulk_delete(self):
+        ids = [task.pk for task in self.tasks]
+        self.assertWithinBudget('task_bulk_action', method='post', data={
+            'action': 'delete', 'task_ids': ids,
+        })
+        self.assertFalse(Task.objects.filter(pk__in=ids).exists())
+        self.assertEqual(TaskStats.objects.get(user=self.user).total, 0)
+        self.assertEqual(self.user.notifications.filter(title='Tasks Deleted').count(), 1)
+
+    def test_task_queue_stats(self):
+        send_welcome_email.apply(args=['budget@example.com', 'budget'])
+        record_lag('tasks.views.send_welcome_email', 40)
+
+        self.assertEqual(self.client.get(reverse('task_queue_stats')).status_code, 302)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        stats = self.assertWithinBudget('task_queue_stats').json()['tasks.views.send_welcome_email']
+        self.assertEqual((stats['runs'], stats['failures'], stats['queue']), (1, 0, 'interactive'))
+        self.assertEqual((stats['lag_avg'], stats['lag_max']), (40, 40))
+
+    def test_bulk_action_ignores_other_users_tasks(self):
+        other = User.objects.create_user('other', password='x')
+        task = Task.objects.create(user=other, title='Not yours')
+        self.client.post(reverse('task_bulk_action'), {'action': 'delete', 'task_ids': [task.pk]})
+        self.assertTrue(Task.objects.filter(pk=task.pk).exists())
+
+    def test_task_form_rejects_other_users_category(self):
+        other = User.objects.create_user('other', password='x')
+        category = Category.objects.create(user=other, name='Private')
+        response = self.client.post(reverse('task_create'), {
+            'title': 'Sneaky', 'status': 'pending', 'priority': 'low', 'category': category.pk,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Task.objects.filter(title='Sneaky').exists())
+
+
+class TaskSearchTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('searcher', password='x')
+        cls.tasks = seed_tasks(cls.user, 3)
+
+    def search(self, query):
+        return [task.title for task in search_tasks(Task.objects.filter(user=self.user), query)]
+
+    def test_best_matches_first(self):
+        Task.objects.create(user=self.user, title='Groceries', description='Also mention the report')
+        Task.objects.create(user=self.user, title='Quarterly report', description='Report on the report numbers')
+        self.assertEqual(self.search('report'), ['Quarterly report', 'Groceries'])
+
+    def test_every_word_is_a_prefix(self):
+        Task.objects.create(user=self.user, title='Quarterly report', description='Numbers for finance')
+        self.assertEqual(self.search('quart fin'), ['Quarterly report'])
+        self.assertEqual(self.search('quart missing'), [])
+
+    def test_query_syntax_is_escaped(self):
+        Task.objects.create(user=self.user, title='Quarterly report', description='')
+        self.assertEqual(self.search('report" OR (*'), [])
+        self.assertEqual(self.search('"report) -'), ['Quarterly report'])
+        self.assertEqual(self.search("'; DROP TABLE tasks_task; --"), [])
+        # Nothing searchable leaves the queryset alone
+        self.assertEqual(len(self.search('*" ()')), 4)
+
+    def test_index_follows_edits_and_deletes(self):
+        task = self.tasks[0]
+        task.title, task.description = 'Renamed entirely', ''
+        task.save()
+        self.assertEqual(self.search('renamed'), ['Renamed entirely'])
+        self.assertNotIn(task.pk, search_tasks(Task.objects.all(), 'task 0').values_list('pk', flat=True))
+
+        task.delete()
+        self.assertEqual(self.search('renamed'), [])
+
+
+class CursorPaginationTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pager', password='x')
+        cls.tasks = seed_tasks(cls.user, 30)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def page_titles(self, **params):
+        response = self.client.get(reverse('task_list'), {'pagination': 'cursor', 'per_page': 5, **params})
+        return [task.title for task in response.context['tasks']], response.context['tasks']
+
+    def test_bad_or_tampered_cursor_returns_the_first_page(self):
+        first, _ = self.page_titles()
+        tampered = encode_cursor(self.tasks[10], 'next')[:-4] + 'AAAA'
+        bad_direction = base64.urlsafe_b64encode(json.dumps(
+            {'c': timezone.now().isoformat(), 'i': 1, 'd': 'sideways'}).encode()).decode()
+        for cursor in ('garbage', tampered, bad_direction, '%%%'):
+            self.assertEqual(self.page_titles(cursor=cursor)[0], first, cursor)
+
+    def test_ties_on_created_at_page_by_id(self):
+        Task.objects.update(created_at=timezone.now())
+        queryset = Task.objects.filter(user=self.user)
+        seen, pages = [], []
+        page = cursor_paginate(queryset, 7)
+        while True:
+            pages.append(page)
+            seen += [task.pk for task in page]
+            if not page.has_next:
+                break
+            page = cursor_paginate(queryset, 7, page.next_cursor)
+
+        self.assertEqual(seen, sorted((task.pk for task in self.tasks), reverse=True))
+        self.assertEqual(len(pages), 5)
+        # Going back from the last page gives the one before it again
+        previous = cursor_paginate(queryset, 7, pages[-1].previous_cursor)
+        self.assertEqual([task.pk for task in previous], [task.pk for task in pages[-2]])
+
+
+class TaskStatsTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('counter', password='x')
+        cls.tasks = seed_tasks(cls.user, 21)
+
+    def assertStatsExact(self):
+        stats = TaskStats.objects.get(user=self.user)
+        expected = TaskStats.compute(self.user, now=stats.overdue_checked_at)
+        self.assertEqual({field: getattr(stats, field) for field in TaskStats.COUNTER_FIELDS},
+                         {field: expected[field] for field in TaskStats.COUNTER_FIELDS})
+
+    def test_counters_follow_edits(self):
+        TaskStats.rebuild(self.user)
+        pending = self.tasks[0]  # pending, low priority, ten days overdue
+        pending.status = 'completed'
+        pending.save()
+        self.assertStatsExact()
+
+        pending.priority = 'urgent'
+        pending.status = 'in_progress'
+        pending.save()
+        self.assertStatsExact()
+
+        pending.due_date = timezone.now() + timedelta(days=3)
+        pending.save()
+        self.assertStatsExact()
+
+        later = self.tasks[20]
+        later.due_date = timezone.now() - timedelta(days=1)
+        later.save()
+        self.assertStatsExact()
+
+        Task.objects.create(user=self.user, title='New', priority='high',
+                            due_date=timezone.now() - timedelta(hours=1))
+        self.tasks[1].delete()
+        self.assertStatsExact()
+
+    def test_batched_changes_match_single_ones(self):
+        TaskStats.rebuild(self.user)
+        with batched_task_changes():
+            for task in self.tasks[:12]:
+                task.status = 'cancelled'
+                task.priority = 'medium'
+                task.save()
+            self.tasks[12].delete()
+        self.assertStatsExact()
+
+    def test_unchanged_counters_cost_nothing(self):
+        TaskStats.record_change((self.user.pk, 'pending', 'low', None), (self.user.pk, 'pending', 'low', None))
+        with self.assertNumQueries(0):
+            TaskStats.apply_changes([((self.user.pk, 'pending', 'low', None), (self.user.pk, 'pending', 'low', None))])
+
+
+class TaskCleanupTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cleaner', password='x')
+        cls.tasks = seed_tasks(cls.user, 30)
+
+    def setUp(self):
+        super().setUp()
+        # Every seeded task is cold; only completed ones have a retention rule
+        Task.objects.update(updated_at=timezone.now() - timedelta(days=90))
+        self.completed = [task for task in self.tasks if task.status == 'completed']
+        TaskAttachment.objects.bulk_create([
+            TaskAttachment(task=self.completed[0], file='raw/upload/v1/task_attachments/a.pdf', file_size=10),
+            TaskAttachment(task=self.completed[1], file='raw/upload/v1/task_attachments/b.pdf', file_size=20),
+        ])
+        self.rules = self.settings(TASK_RETENTION_DAYS={'completed': 60})
+        self.rules.enable()
+        self.addCleanup(self.rules.disable)
+
+    def test_dry_run_deletes_nothing(self):
+        report = cleanup_expired_tasks(dry_run=True)
+        self.assertEqual(report['by_status'], {'completed': 10})
+        self.assertEqual((report['attachments'], report['attachment_bytes']), (2, 30))
+        self.assertEqual(Task.objects.count(), 30)
+
+    def test_deletes_cold_tasks_in_batches(self):
+        Task.objects.filter(pk=self.completed[-1].pk).update(updated_at=timezone.now())
+        with mock.patch('tasks.views.delete_attachment_blobs.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                report = cleanup_expired_tasks(batch_size=4, max_rate=None)
+
+        self.assertEqual((report['deleted'], report['batches']), (9, 3))
+        self.assertEqual(set(Task.objects.filter(status='completed')), {self.completed[-1]})
+        self.assertEqual(Task.objects.count(), 21)
+        self.assertFalse(TaskAttachment.objects.exists())
+        delay.assert_called_once_with(['task_attachments/a', 'task_attachments/b'])
+        stats = TaskStats.objects.get(user=self.user)
+        self.assertEqual((stats.total, stats.completed), (21, 1))
+
+    def test_expired_archived_tasks_are_deleted_too(self):
+        archive_tasks(pause=0, now=timezone.now() + timedelta(days=1))
+        self.assertEqual(ArchivedTask.objects.count(), 10)
+        with mock.patch('tasks.views.delete_attachment_blobs.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                report = cleanup_expired_tasks(max_rate=None)
+
+        self.assertEqual((report['deleted'], report['from_archive']), (10, 10))
+        self.assertFalse(ArchivedTask.objects.exists())
+        delay.assert_called_once_with(['task_attachments/a', 'task_attachments/b'])
+
+    def test_stopping_early_reports_backlog(self):
+        with mock.patch('tasks.views.delete_attachment_blobs.delay'):
+            report = cleanup_expired_tasks(batch_size=4, max_rate=None, max_seconds=0)
+        self.assertEqual((report['deleted'], report['remaining']), (4, 6))
+
+
+class TaskArchiveTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        Task.objects.update(updated_at=timezone.now() - timedelta(days=40))
+        self.completed = [task for task in self.tasks if task.status == 'completed']
+        TaskAttachment.objects.bulk_create([
+            TaskAttachment(task=self.completed[0], file='raw/upload/v1/task_attachments/a.pdf',
+                           filename='a.pdf', file_type='pdf', file_size=10),
+        ])
+
+    def test_moves_cold_closed_tasks(self):
+        Task.objects.filter(pk=self.completed[-1].pk).update(updated_at=timezone.now())
+        report = archive_tasks(batch_size=4, pause=0)
+
+        self.assertEqual((report['archived'], report['batches']), (9, 3))
+        self.assertEqual(Task.objects.filter(status='completed').count(), 1)
+        self.assertEqual(Task.objects.count(), 21)
+        archived = ArchivedTask.objects.get(pk=self.completed[0].pk)
+        self.assertEqual(archived.title, self.completed[0].title)
+        self.assertEqual(archived.attachments[0]['file'], 'raw/upload/v1/task_attachments/a.pdf')
+        self.assertFalse(TaskAttachment.objects.exists())
+        self.assertEqual(TaskStats.objects.get(user=self.user).total, 21)
+
+    def test_archived_filter_lists_and_searches_archive(self):
+        archive_tasks(pause=0)
+        response = self.assertWithinBudget('task_list', data={'status': 'archived'})
+        self.assertEqual(len(response.context['tasks']), 10)
+        self.assertContains(response, reverse('task_restore', kwargs={'pk': self.completed[0].pk}))
+
+        response = self.assertWithinBudget('task_list', data={'status': 'archived', 'search': 'task 29'})
+        self.assertEqual([task.title for task in response.context['tasks']], ['Task 29'])
+
+    def test_restore(self):
+        archive_tasks(pause=0)
+        task = self.completed[0]
+        archived = ArchivedTask.objects.get(pk=task.pk)
+        response = self.assertWithinBudget('task_restore', kwargs={'pk': task.pk}, method='post')
+        self.assertRedirects(response, reverse('task_detail', kwargs={'pk': task.pk}))
+
+        restored = Task.objects.get(pk=task.pk)
+        self.assertEqual((restored.title, restored.status), (task.title, 'completed'))
+        # Keeps its place in the -created_at ordering, but counts as touched
+        self.assertEqual(restored.created_at, archived.created_at)
+        self.assertEqual(restored.created_at, task.created_at)
+        self.assertGreater(restored.updated_at, archived.updated_at)
+        self.assertEqual(restored.attachments.get().filename, 'a.pdf')
+        self.assertFalse(ArchivedTask.objects.filter(pk=task.pk).exists())
+        self.assertEqual(TaskStats.objects.get(user=self.user).completed, 1)
+
+    def test_restored_task_is_not_taken_back(self):
+        archive_tasks(pause=0)
+        task = self.completed[0]
+        # Old enough for the retention rule as well as the archive
+        ArchivedTask.objects.filter(pk=task.pk).update(updated_at=timezone.now() - timedelta(days=90))
+        ArchivedTask.objects.get(pk=task.pk).restore()
+
+        self.assertEqual(archive_tasks(pause=0)['archived'], 0)
+        self.assertEqual(cleanup_expired_tasks(dry_run=True)['deleted'], 0)
+        self.assertTrue(Task.objects.filter(pk=task.pk).exists())
+
+
+class CeleryQueueTests(IsolatedTestCase):
+    def route(self, name):
+        route = celery_app.amqp.router.route({}, name)
+        return route['queue'].name, route.get('priority')
+
+    def test_routing(self):
+        self.assertEqual(self.route('tasks.views.send_welcome_email'), ('interactive', 0))
+        self.assertEqual(self.route('notifications.tasks.check_due_tasks'), ('default', 2))
+        self.assertEqual(self.route('tasks.views.cleanup_old_tasks'), ('batch', 9))
+        self.assertEqual(self.route('task_manager.celery.debug_task'), ('default', None))
+
+    def test_batch_task_requeues_until_done(self):
+        report = {'deleted': 500, 'by_status': {}, 'elapsed': 60, 'rows_per_second': 8, 'remaining': 1200}
+        with mock.patch('tasks.views.cleanup_expired_tasks', return_value=report), \
+                mock.patch.object(cleanup_old_tasks, 'apply_async') as apply_async:
+            cleanup_old_tasks()
+            apply_async.assert_called_once_with(kwargs={'max_seconds': settings.BATCH_TASK_SLICE_SECONDS})
+
+            apply_async.reset_mock()
+            report['remaining'] = 0
+            cleanup_old_tasks()
+            apply_async.assert_not_called()
+
+    def test_welcome_email_leaves_the_backlog_alone(self):
+        backlog = queue_email('other@example.com', 'Reminder', 'Body')
+        send_welcome_email.apply(args=['new@example.com', 'new'])
+        self.assertEqual([message.to for message in mail.outbox], [['new@example.com']])
+        self.assertEqual(list(QueuedEmail.objects.all()), [backlog])
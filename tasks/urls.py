@@ -9,6 +9,9 @@ urlpatterns = [
     path('tasks/<int:pk>/update/', views.task_update, name='task_update'),
     path('tasks/<int:pk>/delete/', views.task_delete, name='task_delete'),
     path('tasks/<int:pk>/complete/', views.task_complete, name='task_complete'),
+    path('tasks/bulk/', views.task_bulk_action, name='task_bulk_action'),
+    path('tasks/archived/<int:pk>/restore/', views.task_restore, name='task_restore'),
+    path('tasks/queues/', views.task_queue_stats, name='task_queue_stats'),
 
      
     # Category URLs
@@ -1,17 +1,29 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.db.models import Q
-from .models import Task, Category, TaskAttachment
+from .models import Task, Category, TaskAttachment, TaskStats, ArchivedTask
 from .forms import TaskForm, CategoryForm, AttachmentForm
-from django.utils import timezone
-from datetime import timedelta, datetime
+from .pagination import cursor_paginate, InvalidCursor
+from .search import search_tasks
+from .bulk import bulk_update_tasks, BulkActionError
+from .retention import cleanup_expired_tasks
+from .archive import archive_tasks, search_archived
+from datetime import datetime
 from datetime import date
-from notifications.utils import notify_task_created, notify_task_updated, notify_task_completed
+from notifications.email import deliver_emails, next_email_at, queue_email, schedule_delivery
+from notifications.utils import notify_task_created, notify_task_updated, notify_task_completed, notify_tasks_bulk_updated
 from django.core.paginator import Paginator
 from django.db import models
 from celery import shared_task
-from django.core.mail import send_mail
+import cloudinary.api
+import cloudinary.exceptions
+from task_manager.celery import app as celery_app
+from task_manager.task_metrics import task_metrics
 
 @login_required
 def task_list(request):
@@ -20,6 +32,7 @@ def task_list(request):
     priority_filter = request.GET.get('priority', '')
     category_filter = request.GET.get('category', '')
     search_query = request.GET.get('search', '')
+    pagination_mode = 'cursor' if request.GET.get('pagination') == 'cursor' else 'page'
     
     # Get per_page parameter or default to 10
     per_page = request.GET.get('per_page', 10)
@@ -30,11 +43,13 @@ def task_list(request):
     except (ValueError, TypeError):
         per_page = 10
     
-    # Start with all tasks for the current user
-    tasks = Task.objects.filter(user=request.user).order_by('-created_at')
+    # Archived tasks live in their own table, everything else in the hot one
+    archived = status_filter == 'archived'
+    model = ArchivedTask if archived else Task
+    tasks = model.objects.filter(user=request.user).select_related('category').order_by('-created_at')
     
     # Apply filters
-    if status_filter:
+    if status_filter and not archived:
         tasks = tasks.filter(status=status_filter)
     
     if priority_filter:
@@ -44,25 +59,29 @@ def task_list(request):
         tasks = tasks.filter(category_id=category_filter)
     
     if search_query:
-        tasks = tasks.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
+        tasks = search_archived(tasks, search_query) if archived else search_tasks(tasks, search_query)
     
     # Get all categories for the filter dropdown
-    all_categories = Category.objects.filter(
-        Q(user=request.user) | Q(user__isnull=True)
-    ).order_by('name')
+    all_categories = Category.cached_for(request.user)
     
     # Paginate tasks
-    paginator = Paginator(tasks, per_page)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if pagination_mode == 'cursor':
+        # Keyset pagination skips the COUNT(*) and OFFSET scans entirely
+        try:
+            page_obj = cursor_paginate(tasks, per_page, request.GET.get('cursor'))
+        except InvalidCursor:
+            page_obj = cursor_paginate(tasks, per_page)
+    else:
+        paginator = Paginator(tasks, per_page)
+        page_number = request.GET.get('page')
+        page_obj = paginator.get_page(page_number)
     
     context = {
         'tasks': page_obj,
+        'pagination_mode': pagination_mode,
         'all_categories': all_categories,
         'status_filter': status_filter,
+        'archived': archived,
         'priority_filter': priority_filter,
         'category_filter': category_filter,
         'search_query': search_query,
@@ -73,7 +92,7 @@ def task_list(request):
 
 @login_required
 def task_detail(request, pk):
-    task = get_object_or_404(Task, pk=pk, user=request.user)
+    task = get_object_or_404(Task.objects.select_related('category'), pk=pk, user=request.user)
     attachments = task.attachments.all()
     
     if request.method == 'POST':
@@ -115,8 +134,6 @@ def task_create(request):
             messages.error(request, 'Please correct the errors below.')
     else:
         form = TaskForm(user=request.user)
-        # Debug: Print category queryset
-        print(f"Category queryset for user {request.user}: {form.fields['category'].queryset}")
     
     context = {
         'form': form,
@@ -138,8 +155,6 @@ def task_update(request, pk):
             messages.error(request, 'Please correct the errors below.')
     else:
         form = TaskForm(instance=task, user=request.user)
-        # Debug: Print category queryset
-        print(f"Category queryset for update: {form.fields['category'].queryset}")
     
     context = {
         'form': form,
@@ -176,25 +191,51 @@ def task_complete(request, pk):
     
     return redirect('task_list')
 
+@login_required
+def task_restore(request, pk):
+    """Move an archived task back into the active list"""
+    archived = get_object_or_404(ArchivedTask, pk=pk, user=request.user)
+    
+    if request.method == 'POST':
+        task = archived.restore()
+        messages.success(request, f'Task "{task.title}" restored from the archive!')
+        return redirect('task_detail', pk=task.pk)
+    
+    return redirect(f"{reverse('task_list')}?status=archived")
+
+@login_required
+def task_bulk_action(request):
+    """Apply one action to many selected tasks"""
+    if request.method != 'POST':
+        return redirect('task_list')
+    
+    action = request.POST.get('action', '')
+    value = request.POST.get(action, '')
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    
+    try:
+        count = bulk_update_tasks(request.user, request.POST.getlist('task_ids'), action, value)
+    except BulkActionError as e:
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        messages.error(request, str(e))
+        return redirect('task_list')
+    
+    notify_tasks_bulk_updated(request.user, action, count)
+    
+    if is_ajax:
+        return JsonResponse({'success': True, 'count': count})
+    
+    messages.success(request, f'{count} task{"" if count == 1 else "s"} updated.')
+    next_url = request.POST.get('next', '')
+    if url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect('task_list')
+
 @login_required
 def dashboard(request):
     # Get statistics
-    total_tasks = Task.objects.filter(user=request.user).count()
-    completed_tasks = Task.objects.filter(user=request.user, status='completed').count()
-    pending_tasks = Task.objects.filter(user=request.user, status='pending').count()
-    in_progress_tasks = Task.objects.filter(user=request.user, status='in_progress').count()
-    
-    # Overdue tasks
-    overdue_tasks = Task.objects.filter(
-        user=request.user,
-        status__in=['pending', 'in_progress'],
-        due_date__lt=date.today()
-    ).count()
-    
-    # Priority statistics
-    high_priority_tasks = Task.objects.filter(user=request.user, priority='high').count()
-    medium_priority_tasks = Task.objects.filter(user=request.user, priority='medium').count()
-    low_priority_tasks = Task.objects.filter(user=request.user, priority='low').count()
+    stats = TaskStats.for_user(request.user)
     
     # Recent tasks with pagination
     recent_per_page = request.GET.get('recent_per_page', 10)
@@ -213,14 +254,14 @@ def dashboard(request):
     recent_tasks_page = paginator.get_page(recent_page_number)
     
     context = {
-        'total_tasks': total_tasks,
-        'completed_tasks': completed_tasks,
-        'pending_tasks': pending_tasks,
-        'in_progress_tasks': in_progress_tasks,
-        'overdue_tasks': overdue_tasks,
-        'high_priority_tasks': high_priority_tasks,
-        'medium_priority_tasks': medium_priority_tasks,
-        'low_priority_tasks': low_priority_tasks,
+        'total_tasks': stats.total,
+        'completed_tasks': stats.completed,
+        'pending_tasks': stats.pending,
+        'in_progress_tasks': stats.in_progress,
+        'overdue_tasks': stats.overdue,
+        'high_priority_tasks': stats.high_priority,
+        'medium_priority_tasks': stats.medium_priority,
+        'low_priority_tasks': stats.low_priority,
         'recent_tasks': recent_tasks_page,
         'recent_per_page': recent_per_page,
     }
@@ -253,15 +294,21 @@ def manage_categories(request):
         per_page = 10
     
     # Get categories for the current user plus global categories
-    categories = Category.objects.filter(
-        models.Q(user=request.user) | models.Q(user__isnull=True)
-    ).order_by('name')
+    categories = Category.cached_for(request.user)
     
     # Paginate categories
     paginator = Paginator(categories, per_page)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
+    # Task counts for the visible page only, in one grouped query
+    task_counts = dict(
+        Task.objects.filter(category__in=page_obj.object_list)
+        .values_list('category').annotate(count=models.Count('id'))
+    )
+    for category in page_obj:
+        category.task_count = task_counts.get(category.pk, 0)
+    
     if request.method == 'POST':
         form = CategoryForm(request.POST)
         if form.is_valid():
@@ -337,18 +384,58 @@ def delete_attachment(request, pk):
     return redirect('task_detail', pk=task_pk)
 
 
+@staff_member_required
+def task_queue_stats(request):
+    """Queue lag and runtime per Celery task, with its queue (staff only)"""
+    routes = settings.CELERY_TASK_ROUTES
+    names = [name for name in celery_app.tasks if not name.startswith('celery.')]
+    metrics = task_metrics(names)
+    for name, stats in metrics.items():
+        stats['queue'] = routes.get(name, {}).get('queue', settings.CELERY_TASK_DEFAULT_QUEUE)
+    return JsonResponse(metrics)
+
+
 @shared_task
 def send_welcome_email(user_email, username):
     """ব্যবহারকারীকে স্বাগতম ইমেইল পাঠানো"""
     subject = f'Welcome {username} to Task Manager!'
     message = 'Thank you for joining our task management system.'
-    send_mail(subject, message, 'admin@taskmanager.com', [user_email])
+    email = queue_email(user_email, subject, message)
+    # Only this email; the rest of the backlog belongs to the default queue
+    if not deliver_emails(pks=[email.pk]):
+        schedule_delivery(next_email_at())
+        return f'Email to {user_email} queued for retry'
     return f'Email sent to {user_email}'
 
 @shared_task
-def cleanup_old_tasks():
-    """60 দিনের পুরোনো টাস্ক ডিলিট করা"""
-    
-    old_date = timezone.now() - timedelta(days=60)
-    deleted_count = Task.objects.filter(created_at__lt=old_date).delete()[0]
-    return f'Deleted {deleted_count} old tasks'
+def cleanup_old_tasks(dry_run=False, max_seconds=None):
+    """TASK_RETENTION_DAYS অনুযায়ী পুরোনো টাস্ক ব্যাচে ডিলিট করা"""
+    max_seconds = max_seconds or settings.BATCH_TASK_SLICE_SECONDS
+    report = cleanup_expired_tasks(dry_run=dry_run, max_seconds=max_seconds)
+    if dry_run:
+        return (f"Would delete {report['deleted']} old tasks {report['by_status']} "
+                f"with {report['attachments']} attachments ({report['attachment_bytes']} bytes)")
+    if report['remaining']:
+        # Re-queue the rest behind whatever else is waiting on the batch queue
+        cleanup_old_tasks.apply_async(kwargs={'max_seconds': max_seconds})
+    return (f"Deleted {report['deleted']} old tasks {report['by_status']} in {report['elapsed']}s "
+            f"({report['rows_per_second']} rows/s), {report['remaining']} remaining")
+
+@shared_task
+def archive_old_tasks(max_seconds=None):
+    """TASK_ARCHIVE_DAYS এর পুরোনো বন্ধ টাস্ক আর্কাইভে সরানো"""
+    max_seconds = max_seconds or settings.BATCH_TASK_SLICE_SECONDS
+    report = archive_tasks(max_seconds=max_seconds)
+    if report['remaining']:
+        archive_old_tasks.apply_async(kwargs={'max_seconds': max_seconds})
+    return (f"Archived {report['archived']} tasks in {report['elapsed']}s "
+            f"({report['rows_per_second']} rows/s), {report['remaining']} remaining")
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=60)
+def delete_attachment_blobs(self, public_ids):
+    """Remove the Cloudinary files of attachments whose rows were cleaned up"""
+    try:
+        cloudinary.api.delete_resources(public_ids, resource_type='raw')
+    except cloudinary.exceptions.Error as exc:
+        raise self.retry(exc=exc)
+    return f'Deleted {len(public_ids)} attachment blobs'